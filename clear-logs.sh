@@ -1,2 +1,4 @@
+# Fold the logs into the history store first so clearing them doesn't lose any history
+(cd python && python watches_ingest.py) || { echo Ingest failed, keeping logs; exit 1; }
 rm logs/* || echo No files to remove
 echo Exit
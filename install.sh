@@ -1,13 +1,32 @@
-sudo cp services/watches-server.service /etc/systemd/system
-sudo cp services/watches-sensor.service /etc/systemd/system
-sudo cp services/watches-controller.service /etc/systemd/system
+# Usage: ./install.sh [--headless] [--broker]
+#   --headless  Run the plant manager with the web dashboard instead of a desktop window (set "display_mode": "web")
+#   --broker    Also run the forwarding broker (set "use_broker": true)
+SERVICES="watches-server watches-sensor watches-controller"
+
+for arg in "$@"
+do
+    case $arg in
+        --headless) SERVICES="watches-server-headless watches-sensor watches-controller" ;;
+        --broker) BROKER=watches-broker ;;
+    esac
+done
+
+# The broker goes first so the other services can connect to it
+SERVICES="$BROKER $SERVICES"
+
+for service in $SERVICES
+do
+    sudo cp services/$service.service /etc/systemd/system
+done
 
 sudo systemctl daemon-reload
 
-sudo systemctl enable watches-server
-sudo systemctl enable watches-sensor
-sudo systemctl enable watches-controller
+for service in $SERVICES
+do
+    sudo systemctl enable $service
+done
 
-sudo systemctl start watches-server
-sudo systemctl start watches-sensor
-sudo systemctl start watches-controller
+for service in $SERVICES
+do
+    sudo systemctl start $service
+done
@@ -0,0 +1,26 @@
+# Usage: ./profile.sh server|sensor|controller [cpu|memory [stop]]
+# cpu (default) starts a profiling session, run it again to stop it and write the results to logs/
+# memory starts tracemalloc, run it again to write a snapshot of the top allocations to logs/
+# memory stop writes a final snapshot and stops tracemalloc
+unit=""
+for service in watches-$1 watches-$1-headless
+do
+    if [ -f /etc/systemd/system/$service.service ]
+    then
+        unit=$service
+        break
+    fi
+done
+
+if [ -z "$unit" ]; then
+    echo "No installed WATCHES service for $1"
+    exit 1
+fi
+
+if [ "$2" = "memory" ] && [ "$3" = "stop" ]; then
+    sudo systemctl kill -s SIGRTMIN $unit
+elif [ "$2" = "memory" ]; then
+    sudo systemctl kill -s SIGUSR2 $unit
+else
+    sudo systemctl kill -s SIGUSR1 $unit
+fi
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import zmq
+
+parent_dir = os.path.split(os.getcwd())[0]
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Daemon scripts, the module each one imports and its log file prefix
+SERVICES = dict(sensor=("temp_sensor_interface.py", "temp_sensor_interface", "SENSOR"),
+                fan=("fan_controller.py", "fan_controller", "FANCONTROL"),
+                server=("watches_server.py", "watches_server", "PLANTMANAGER"))
+
+def bench_config(base_cfg:str, work_dir:str, display_mode:str) -> dict:
+    """Build a debug configuration isolated from any running WATCHES instance
+
+    Args:
+        base_cfg (str): Configuration file to start from
+        work_dir (str): Scratch directory for sockets, logs and snapshots
+        display_mode (str): Plant manager display mode, "web" or "tk"
+
+    Returns:
+        dict: Configuration
+    """
+    with open(base_cfg) as f:
+        config = json.load(f).get("config")
+
+    config.update(fan_debug=True,
+                  sensor_debug=True,
+                  enable_temp_override=False,
+                  use_broker=False,
+                  server_sub_socket="ipc://" + os.path.join(work_dir, "server_sub"),
+                  server_pub_socket="ipc://" + os.path.join(work_dir, "server_pub"),
+                  display_mode=display_mode,
+                  dashboard_host="127.0.0.1",
+                  dashboard_port=0,
+                  snapshot_dir=os.path.join(work_dir, "snapshots"))
+
+    return config
+
+def read_memory(pid:int) -> dict:
+    """Read the resident set size of a process from /proc
+
+    Args:
+        pid (int): Process id
+
+    Returns:
+        dict: Current (VmRSS) and peak (VmHWM) resident size in KiB, empty if /proc is unavailable
+    """
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        pass
+
+    return memory
+
+def import_time(module:str, run_dir:str) -> float:
+    """Time importing a daemon module in a fresh interpreter
+
+    Args:
+        module (str): Module name
+        run_dir (str): Working directory for the interpreter
+
+    Returns:
+        float: Seconds spent in the import
+    """
+    code = f"import sys, time; sys.path.insert(0, {code_dir!r}); t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=run_dir, check=True, capture_output=True, text=True)
+
+    return float(out.stdout.split()[-1])
+
+def entered_run_loop(log_dir:str, prefix:str, existing:set) -> bool:
+    """Check whether a service has logged that it entered its run loop
+
+    Args:
+        log_dir (str): Logs directory of the scratch tree
+        prefix (str): Log file prefix of the service
+        existing (set): Log files from earlier runs, ignored
+
+    Returns:
+        bool: True once a new log file holds the run loop line
+    """
+    for fname in set(glob.glob(os.path.join(log_dir, prefix + "-*.log"))) - existing:
+        with open(fname) as f:
+            if "Entering run loop" in f.read():
+                return True
+
+    return False
+
+def start_peer(ctx:zmq.Context, service:str, config:dict) -> tuple:
+    """Open the sockets of the other end of a service's links
+
+    Args:
+        ctx (zmq.Context): ZMQ context
+        service (str): Service being measured
+        config (dict): Benchmark configuration
+
+    Returns:
+        tuple: (publisher, subscriber, prompt message or None, topic of the expected reply)
+    """
+    publisher = ctx.socket(zmq.PUB)
+    subscriber = ctx.socket(zmq.SUB)
+
+    if service == "server":
+        # Stand in for the sensor: feed readings above the set point until a fan command comes out
+        publisher.connect(config["server_sub_socket"])
+        subscriber.connect(config["server_pub_socket"])
+        prompt = f"temp::{config['set_point'] + 10}::{time.strftime('%H:%M:%S')}"
+        topic = "fancontrol"
+    else:
+        # Stand in for the plant manager. The sensor is not prompted and its first reading races the
+        # subscription (the ZMQ slow joiner), so its start up is timed by the run loop alone.
+        publisher.bind(config["server_pub_socket"])
+        subscriber.bind(config["server_sub_socket"])
+        prompt = "fancontrol::getstate" if service == "fan" else None
+        topic = "fanstate" if service == "fan" else "temp"
+
+    subscriber.subscribe(topic)
+
+    return publisher, subscriber, prompt, topic
+
+def measure(service:str, config:dict, run_dir:str, timeout:float) -> dict:
+    """Cold start a service, wait for it to enter its run loop and, if it answers a prompt, for its first reply
+
+    Args:
+        service (str): Service name, a key of SERVICES
+        config (dict): Benchmark configuration
+        run_dir (str): Working directory for the service, inside the scratch tree
+        timeout (float): Seconds to wait
+
+    Returns:
+        dict: Seconds to the run loop and to the first reply, and resident memory at the end
+    """
+    ctx = zmq.Context()
+    publisher, subscriber, prompt, topic = start_peer(ctx, service, config)
+    script, _, prefix = SERVICES[service]
+
+    log_dir = os.path.join(os.path.dirname(run_dir), "logs")
+    existing = set(glob.glob(os.path.join(log_dir, prefix + "-*.log")))
+
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(code_dir, script)], cwd=run_dir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = dict(ready=None, first_reply=None)
+
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline and proc.poll() is None:
+            if result["ready"] is None and entered_run_loop(log_dir, prefix, existing):
+                result["ready"] = time.perf_counter() - start
+
+            if prompt is None:
+                time.sleep(0.02)
+            else:
+                publisher.send_string(prompt)
+                if subscriber.poll(20):
+                    subscriber.recv_string()
+                    result["first_reply"] = time.perf_counter() - start
+
+            if result["ready"] is not None and (prompt is None or result["first_reply"] is not None):
+                result.update(read_memory(proc.pid))
+                break
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        publisher.close(linger=0)
+        subscriber.close(linger=0)
+        ctx.term()
+
+    return result
+
+def summarize(values:list) -> str:
+    """Format the median and range of repeated measurements
+    """
+    values = [value for value in values if value is not None]
+    if not values:
+        return "n/a"
+
+    return f"{statistics.median(values):8.1f} ({min(values):.1f}-{max(values):.1f})"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure WATCHES cold start time to the run loop and first reply, and resident memory")
+    parser.add_argument("services", nargs="*", default=list(SERVICES), help="Services to measure (sensor, fan, server)")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per service")
+    parser.add_argument("--display", default="web", choices=["web", "tk"], help="Plant manager display mode")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a service to start")
+    parser.add_argument("--config", default=os.path.join(parent_dir, "cfg", "watches_cfg.json"), help="Configuration to start from")
+    args = parser.parse_args()
+
+    # The services find their configuration and logs relative to their working directory,
+    # so give them a scratch tree of their own
+    work_dir = tempfile.mkdtemp(prefix="watches-bench-")
+    run_dir = os.path.join(work_dir, "python")
+    os.makedirs(os.path.join(work_dir, "cfg"))
+    os.makedirs(run_dir)
+
+    config = bench_config(args.config, work_dir, args.display)
+    with open(os.path.join(work_dir, "cfg", "watches_cfg.json"), 'w') as f:
+        json.dump(dict(config=config), f, indent=4)
+
+    print(f"{'service':8s} {'import ms':>22s} {'run loop ms':>22s} {'first reply ms':>22s} {'RSS MiB':>22s} {'peak RSS MiB':>22s}")
+
+    try:
+        for service in args.services:
+            imports, readies, firsts, rss, peaks = [], [], [], [], []
+
+            for _ in range(args.runs):
+                # Start every run from a clean slate, a warm restart snapshot would change the startup path
+                shutil.rmtree(config["snapshot_dir"], ignore_errors=True)
+
+                imports.append(1e3 * import_time(SERVICES[service][1], run_dir))
+                result = measure(service, config, run_dir, args.timeout)
+
+                readies.append(None if result["ready"] is None else 1e3 * result["ready"])
+                firsts.append(None if result["first_reply"] is None else 1e3 * result["first_reply"])
+                rss.append(result["VmRSS"] / 1024 if "VmRSS" in result else None)
+                peaks.append(result["VmHWM"] / 1024 if "VmHWM" in result else None)
+
+            print(f"{service:8s} {summarize(imports):>22s} {summarize(readies):>22s} {summarize(firsts):>22s} {summarize(rss):>22s} {summarize(peaks):>22s}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
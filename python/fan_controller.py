@@ -1,39 +1,22 @@
 #!/usr/bin/env python3
 
-import numpy as np
-from numpy import random as rnd
 import zmq
 import time
 from datetime import datetime as dt
 import sys, os
 import logging
-import logging.handlers
 import json
 
+from watches_journal import journal_writer
+from watches_logging import setup_logging
+from watches_profiling import profiling_hooks
+from watches_snapshot import state_snapshot
+from watches_sockets import apply_socket_policy, message_drain, sequenced_socket, zoned_topics
+
 # TODO: Add proper state setting
 
-# Set up the logger
-now = dt.now()
+# Logging is configured in __main__, so importing this module has no side effects
 parent_dir = os.path.split(os.getcwd())[0]
-log_dir = os.path.join(parent_dir, "logs")
-
-# Make a logs directory if it does not exist
-if not os.path.isdir(log_dir):
-    os.mkdir(log_dir)
-    
-logname = os.path.join(log_dir, "FANCONTROL-" + now.strftime('%Y-%m-%dT%H-%M-%S') + ('-%02d' % (now.microsecond / 10000)) + ".log")
-
-rfh = logging.handlers.RotatingFileHandler(filename=logname, 
-    mode='a',
-    maxBytes=5*1024*1024,
-    backupCount=1,
-    encoding=None,
-    delay=0,
-)
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%m/%d/%Y %I:%M:%S%p', 
-                    level=logging.INFO,
-                    handlers=[rfh])
 
 logger = logging.getLogger('WATCHES-FANCONTROL')
 
@@ -51,17 +34,28 @@ class fan_controller:
         # Load config file
         self.load_cfg(config_fname)
         
-        # Add message topics (self documenting)
-        self.topics = dict(fanstate='fanstate', fancontrol='fancontrol', error='error')
-        self.requests = dict(getstate="getstate", turnon="turnon", turnoff="turnoff")
+        # Add message topics (self documenting), prefixed with our zone if we have one
+        self.topics = zoned_topics(self.config, fanstate='fanstate', relaystate='relaystate', fancontrol='fancontrol', error='error')
+        self.requests = dict(getstate="getstate", turnon="turnon", turnoff="turnoff", set="set")
         self.states = dict(on="on", off="off", error="error")
         
         # Default state to off
         self.state = self.states.get("off")
+        
+        # Addressable relay channels by name. A plain relay_pin config is a single channel named "fan"
+        self.channels = dict(self.config.get("relay_channels") or {"fan": self.config.get("relay_pin")})
+        
+        # Cached state of every channel, so state queries never touch the hardware
+        self.channel_states = {name: self.states.get("off") for name in self.channels}
+        
+        # Channel changes requested since the last GPIO pass, applied together by apply_pending
+        self.pending = {}
+        self.report_requested = False
 
         # Establish a ZMQ publishing socket
         self._ctx = zmq.Context()
-        self.publisher = self._ctx.socket(zmq.PUB)
+        self.publisher = sequenced_socket(self._ctx.socket(zmq.PUB), "fan_controller")
+        apply_socket_policy(self.publisher, self.config)
         
         # Publish to the socket that the server is listening on
         self.publisher.connect(str(self.config.get("server_sub_socket")))
@@ -69,32 +63,49 @@ class fan_controller:
         # Establish a ZMQ subscriber socket to listen to command and control from the server
         # Subscribe to server publish socket
         self.subscriber = self._ctx.socket(zmq.SUB)
+        apply_socket_policy(self.subscriber, self.config)
         self.subscriber.connect(str(self.config.get("server_pub_socket")))
+        self.drain = message_drain(self.subscriber, self.config, "Fan controller")
         
-        # Subscribe to get fanstate commands
-        self.subscriber.subscribe(self.topics.get('fanstate')) 
-        
-        # Subscribe to fancontrol commands
+        # Subscribe to fancontrol commands. Not to fanstate: behind the broker that is our own
+        # report echoed back, and it doesn't carry commands.
         self.subscriber.subscribe(self.topics.get('fancontrol'))
                 
+        # Durable binary journal of relay changes
+        self.journal = journal_writer(self.config, "FANCONTROL")
+        
+        # Resume the relay states from before a restart, if there is a fresh snapshot
+        self.snapshot = state_snapshot(self.config, "fan_controller")
+        saved = self.snapshot.load() or {}
+        saved_channels = saved.get("channels") or {name: saved.get("state") for name in self.channels}
+        restored = {name: state for name, state in saved_channels.items()
+                    if name in self.channels and state in (self.states.get("on"), self.states.get("off"))}
+                
         # Provision for a debug mode where we provide fake temperature data
         if not self.config.get("fan_debug"):
             import RPi.GPIO as GPIO
+            self.gpio = GPIO
 
-            # Set the relay pin per the spec sheet of the relay hat and the wiring spec
-            self.relay_pin = self.config.relay_pin
-            # Set up the GPIO fan control pin
+            # Set up the GPIO relay pins per the spec sheet of the relay hat and the wiring spec,
+            # driving them straight to the resumed state so the relays never toggle
             GPIO.setmode(GPIO.BCM)
-            GPIO.setup(self.relay_pin, GPIO.OUT)
-
-            # Set initial state to OFF
-            self.set_OFF()
+            for name, pin in self.channels.items():
+                initial = GPIO.HIGH if restored.get(name) == self.states.get("on") else GPIO.LOW
+                GPIO.setup(pin, GPIO.OUT, initial=initial)
         else:
-            # If in debug mode, don't invoke the actual relays. Handle in ON/OFF calls
+            # If in debug mode, don't invoke the actual relays. Handle in write_channels
+            self.gpio = None
             logger.info("Started fan controller in Debug mode:")
+            
+        if not restored:
+            # Set initial state to OFF
             self.set_OFF()
+        else:
+            self.channel_states.update(restored)
+            self.state = self.get_GPIO_state()
+            logger.info(f"Resumed relay states {self.channel_states} from snapshot")
+            self.send_GPIO_state()
         
-
     def load_cfg(self, config_fname:str):
         """ Read the config JSON in as a struct
 
@@ -124,21 +135,26 @@ class fan_controller:
         # Enter forever loop
         while True:
             
-            try:
-                # Look for any messages from the server - don't block
-                message = self.subscriber.recv_string(flags=zmq.NOBLOCK)
-                
+            # Take every message waiting from the server - don't block
+            for message in self.drain.poll():
                 # Parse the message from the server
                 self.parse_message(message)
-            
-            except zmq.Again as e:
-                # If no message rx'd, do nothing
-                pass            
+                
+            # Apply every relay change requested in this pass at once
+            self.apply_pending()
+                
+            # Checkpoint the relay state for a warm restart
+            if self.snapshot.due():
+                self.save_snapshot()
+                
+            # Commit journaled events once per fsync interval
+            self.journal.tick()
             
             time.sleep(self.config.get("server_update_rate"))
             
     def parse_message(self, msg):
-        """Parse messages received over the ZMQ server subscriber port and execute function
+        """Parse messages received over the ZMQ server subscriber port and stage the request.
+        Relay changes take effect on the next apply_pending call.
 
         Args:
             msg (str): Message received over the ZMQ interface
@@ -155,13 +171,18 @@ class fan_controller:
         if topic == self.topics.get("fancontrol"):
             
             logger.info(f"Got request {messagedata} from plant manager")
-
-            if messagedata == self.requests.get("getstate"):
-                self.send_GPIO_state()
-            elif messagedata == self.requests.get("turnoff"):
-                self.set_OFF()
-            elif messagedata == self.requests.get("turnon"):
-                self.set_ON()
+            
+            # Addressed requests carry arguments after the request name, e.g. set:fan=on,stage2=off
+            request, _, args = messagedata.partition(':')
+
+            if request == self.requests.get("getstate"):
+                self.report_requested = True
+            elif request == self.requests.get("turnoff"):
+                self.stage_all(self.states.get("off"))
+            elif request == self.requests.get("turnon"):
+                self.stage_all(self.states.get("on"))
+            elif request == self.requests.get("set"):
+                status = self.stage_channels(args)
             else:
                 logger.warning("Received unrecognized request over ZMQ")
                 status = -100
@@ -171,143 +192,173 @@ class fan_controller:
                      
         return status          
 
+    def stage_all(self, state:str) -> None:
+        """Stage every relay channel to the same state
+
+        Args:
+            state (str): Requested state
+        """
+        for name in self.channels:
+            self.pending[name] = state
+        self.report_requested = True
         
-            
-    def set_ON(self) -> int:
-        """Set the relay GPIO to high, thereby turning the fan circuit ON, and report to server
+    def stage_channels(self, args:str) -> int:
+        """Stage addressed relay channel changes
+
+        Args:
+            args (str): Comma separated channel=state pairs, e.g. fan=on,stage2=off
 
         Returns:
             int: Status
         """
         status = 1
         
-        try:
-            # Set the fan state via GPIO
-            GPIO.output(self.relay_pin, GPIO.HIGH) 
+        for item in args.split(','):
+            name, _, state = item.partition('=')
             
-            # Update the state tracker   
-            read_state = self.get_GPIO_state()
+            if name not in self.channels or state not in (self.states.get("on"), self.states.get("off")):
+                logger.warning(f"Ignoring unrecognized relay request {item}")
+                status = -100
+                continue
             
-            if read_state == self.states.get("on"):
-                # Log event
-                logger.info("Fan turned ON")
-                
-            elif read_state == self.states.get("off"):
-                logger.warning("Asked for ON, got OFF")
-                
-            else:
-                logger.warning("Relay pin reported unrecognized state")
-                                                
-            # Send ack message to server
-            self.send_GPIO_state()       
+            self.pending[name] = state
             
-        except:
-            # If we are in debug mode, the above wont work so go here.
-            if self.config.get("fan_debug"):
-                logger.info("DEBUG MODE: Fan turned ON")
-                
-                # Set the state variable without actually turning on the relay/fan assembly
-                self.state = self.states.get("on")
-                self.send_GPIO_state()
-
-            # If we are not in debug mode but we get here, it is an error
-            else:
-                logger.warning("Unable to turn fan ON.")
-                status = -100
-                
-                # Send the current state with an error message
-                msg = self.add_topic(self.topics.get('error'), self.get_GPIO_state())
-                self.publisher.send_string(msg)
-                logger.info("Sent error message and current state to plant manager")
-                
+        self.report_requested = True
+        
         return status
-                
-
-    def set_OFF(self) -> int:
-        """Set the relay GPIO to low, thereby turning the fan circuit OFF, and report to server
+    
+    def apply_pending(self) -> int:
+        """Apply all staged channel changes in a single GPIO pass, then send a single state report
 
         Returns:
             int: Status
         """
-        
         status = 1
         
-        try:
-            
-            # Set the fan state via GPIO
-            GPIO.output(self.relay_pin, GPIO.LOW) 
-            
-            # Update the state tracker   
-            read_state = self.get_GPIO_state()
-            
-            if read_state == self.states.get("off"):
-                # Log event
-                logger.info("Fan turned OFF")
-                
-            elif read_state == self.states.get("off"):
-                logger.warning("Asked for OFF, got ON")
-                
-            else:
-                logger.warning("Relay pin reported unrecognized state")
+        changes = {name: state for name, state in self.pending.items() if self.channel_states[name] != state}
+        self.pending = {}
+        
+        if changes:
+            status = self.write_channels(changes)
             
-            # Send ack message to server
+        if self.report_requested:
             self.send_GPIO_state()
+            self.report_requested = False
             
-        except:
-            
-            # If we are in debug mode, the above wont work so go here.
-            if self.config.get("fan_debug"):
-                logger.info("DEBUG MODE: Fan turned OFF")
-                
-                # Set the state variable without actually turning on the relay/fan assembly
-                self.state = self.states.get("off")
-                self.send_GPIO_state()
+        return status
+    
+    def write_channels(self, changes:dict) -> int:
+        """Drive a set of relay channels with one batched GPIO write and update the state cache
+
+        Args:
+            changes (dict): Channel name to requested state
 
+        Returns:
+            int: Status
+        """
+        status = 1
+        previous = self.state
+        
+        try:
+            if self.gpio is not None:
+                # Set all the relays in one call
+                pins = [self.channels[name] for name in changes]
+                values = [self.gpio.HIGH if state == self.states.get("on") else self.gpio.LOW for state in changes.values()]
+                self.gpio.output(pins, values)
                 
-            # If we are not in debug mode but we get here, it is an error
+                # Read each changed pin back once to verify it and refresh the cache
+                for name, pin in zip(changes, pins):
+                    read_state = self.states.get("on") if self.gpio.input(pin) else self.states.get("off")
+                    self.channel_states[name] = read_state
+                    
+                    if read_state != changes[name]:
+                        logger.warning(f"Asked relay {name} for {changes[name].upper()}, got {read_state.upper()}")
+                        
+                prefix = ""
             else:
-                logger.warning("Unable to turn fan OFF.")
-                status = -100
+                # In debug mode, set the state variables without actually switching the relays
+                self.channel_states.update(changes)
+                prefix = "DEBUG MODE: "
                 
-                # Send the current state with an error message
-                msg = self.add_topic(self.topics.get('error'), str(self.get_GPIO_state()))
-                self.publisher.send_string(msg)
-                logger.info("Sent error message and current state to plant manager")
+            logger.info(f"{prefix}Set relays {changes}")
+            
+            self.state = self.get_GPIO_state()
+            if self.state != previous:
+                logger.info(f"{prefix}Fan turned {self.state.upper()}")
+                self.journal.record_state("relay_state", self.state)
                 
+        except Exception as e:
+            requested = self.states.get("on") if self.states.get("on") in changes.values() else self.states.get("off")
+            # Keep this line exact, the history ingest matches it. The cause goes on its own line.
+            logger.warning(f"Unable to turn fan {requested.upper()}.")
+            logger.warning(f"Relay write failed: {e}")
+            status = -100
+            
+            # Send the current state with an error message
+            msg = self.add_topic(self.topics.get('error'), self.get_GPIO_state())
+            self.publisher.send_string(msg)
+            logger.info("Sent error message and current state to plant manager")
+            
         return status
+            
+    def set_ON(self) -> int:
+        """Set every relay GPIO to high, thereby turning the fan circuits ON, and report to server
+
+        Returns:
+            int: Status
+        """
+        self.stage_all(self.states.get("on"))
         
-    def get_GPIO_state(self) -> bool:
-        """Get the current state of the relay GPIO pin
+        return self.apply_pending()
+
+    def set_OFF(self) -> int:
+        """Set every relay GPIO to low, thereby turning the fan circuits OFF, and report to server
 
         Returns:
-            bool: Return the state of the GPIO pin
+            int: Status
         """
-        read_state = GPIO.input(self.relay_pin)
+        self.stage_all(self.states.get("off"))
         
-        if read_state == True:
-            self.state = self.states.get("on")
-        elif read_state == False:
-            self.state = self.states.get("off")
-        else:
-            return -100
-            
-        logger.info(f"Requested fan state, got {read_state}")
+        return self.apply_pending()
+        
+    def get_GPIO_state(self) -> str:
+        """Get the overall fan state from the relay state cache. The fan is on if any channel is on.
 
-        return self.state
+        Returns:
+            str: Return the fan state
+        """
+        if self.states.get("on") in self.channel_states.values():
+            return self.states.get("on")
+        
+        return self.states.get("off")
     
     def send_GPIO_state(self) -> None:
-        """Send relay state to server
+        """Send relay states to server: every channel in one relaystate message, and the overall fanstate
         """
-        msg = self.add_topic(self.topics.get('fanstate'), self.get_GPIO_state())
+        channels = ','.join(f"{name}={state}" for name, state in self.channel_states.items())
+        self.publisher.send_string(self.add_topic(self.topics.get('relaystate'), channels))
+        
+        self.state = self.get_GPIO_state()
+        msg = self.add_topic(self.topics.get('fanstate'), self.state)
         self.publisher.send_string(msg)
-        logger.info(f"Sent state {self.state} to plant manager")
+        logger.info(f"Sent state {self.state} ({channels}) to plant manager")
+        
+        # Every state change is reported, so checkpoint here too
+        self.save_snapshot()
 
         return
     
+    def save_snapshot(self) -> None:
+        """Checkpoint the relay states so a restart resumes them instead of switching the fans off
+        """
+        self.snapshot.save(dict(state=self.state, channels=self.channel_states))
+    
     def exit(self):
         """Gracefully shutdown zmq ports and exit the program
         """
         logger.info("Gracefully exiting")
+        self.save_snapshot()
+        self.journal.close()
         self.publisher.close()
         self.subscriber.close()
         self._ctx.term()
@@ -316,12 +367,20 @@ class fan_controller:
     
 if __name__ == "__main__":
 
+    # Log to a new file in the logs directory
+    log_dir = setup_logging("FANCONTROL", parent_dir)
+
     # Specify configuration file
     cfg = os.path.join(parent_dir, "cfg", "watches_cfg.json")
     
     # Create a digital sensor object to mirror our physical one
     fan = fan_controller(cfg)
     
+    # On demand profiling, triggered with SIGUSR1/SIGUSR2
+    profiler = profiling_hooks("FANCONTROL", log_dir, fan.config)
+    profiler.register(fan, ["parse_message", "apply_pending", "write_channels", "send_GPIO_state", "save_snapshot"])
+    profiler.install()
+    
     # Handle exits
     try:
         fan.run()
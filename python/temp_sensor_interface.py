@@ -1,39 +1,22 @@
 #!/usr/bin/env python3
 
-import numpy as np
-from numpy import random as rnd
+import math
 import zmq
 import time
 from datetime import datetime as dt
 import sys, os
 import logging
-import logging.handlers
 import json
 
+from watches_journal import journal_writer
+from watches_logging import setup_logging
+from watches_profiling import profiling_hooks
+from watches_sockets import apply_socket_policy, sequenced_socket, zoned_topics
+
 #DONE
 
-# Set up the logger
-now = dt.now()
+# Logging is configured in __main__, so importing this module has no side effects
 parent_dir = os.path.split(os.getcwd())[0]
-log_dir = os.path.join(parent_dir, "logs")
-
-# Make a logs directory if it does not exist
-if not os.path.isdir(log_dir):
-    os.mkdir(log_dir)
-    
-logname = os.path.join(log_dir, "SENSOR-" + now.strftime('%Y-%m-%dT%H-%M-%S') + ('-%02d' % (now.microsecond / 10000)) + ".log")
-
-rfh = logging.handlers.RotatingFileHandler(filename=logname, 
-    mode='a',
-    maxBytes=5*1024*1024,
-    backupCount=1,
-    encoding=None,
-    delay=0,
-)
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%m/%d/%Y %I:%M:%S%p', 
-                    level=logging.INFO,
-                    handlers=[rfh])
 
 logger = logging.getLogger('WATCHES-SENSOR')
 
@@ -51,12 +34,19 @@ class temp_sensor_interface:
         # Load config file
         self.load_cfg(config_fname)
         
+        # Durable binary journal of sensor errors
+        self.journal = journal_writer(self.config, "SENSOR")
+        
         # Contingency for unable to read sensor
         self.last_reading = 0
 
+        # Add message topic, prefixed with our zone if we have one
+        self.topics = zoned_topics(self.config, temp='temp')
+
         # Establish a ZMQ publishing socket
         self._ctx = zmq.Context()
-        self.publisher = self._ctx.socket(zmq.PUB)
+        self.publisher = sequenced_socket(self._ctx.socket(zmq.PUB), "temp_sensor")
+        apply_socket_policy(self.publisher, self.config)
         
         # Publish to the socket that the server is listening on
         self.publisher.connect(str(self.config.get("server_sub_socket")))
@@ -69,9 +59,6 @@ class temp_sensor_interface:
             logger.info("Sensor started in Debug mode")
             self.sensor1 = fake_sensor(self.config.get("enable_temp_override"),
                                        self.config.get("override_temp_c"))
-        
-        # Add message topic
-        self.topics = dict(temp='temp')
 
     def load_cfg(self, config_fname:str) -> None:
         """ Read the config JSON in as a struct
@@ -127,6 +114,7 @@ class temp_sensor_interface:
             except Exception as e:
                 temp_data = self.last_reading
                 logger.warning(f"Sensor error {e}, reporting last sensor reading")
+                self.journal.record("sensor_error", temp_data)
 
             # Construct a message string to send over ZMQ
             message = self.add_topic(self.topics.get('temp'), temp_data)
@@ -137,6 +125,9 @@ class temp_sensor_interface:
             # Log the temperature reading
             logger.info(f"Sensor Reading: {temp_data}")
 
+            # Commit journaled events once per fsync interval
+            self.journal.tick()
+
             # Loops are ungoverned, so we have to force a sleep every time or else we will run at 100% computing power
             time.sleep(self.config.get("temp_update_rate"))
             
@@ -144,6 +135,7 @@ class temp_sensor_interface:
         """Gracefully shutdown zmq ports and exit the program
         """
         logger.info("Gracefully exiting")
+        self.journal.close()
         self.publisher.close()
         self._ctx.term()
         print("\nshutdown")
@@ -164,18 +156,27 @@ class fake_sensor():
         if self.override:
             return self.override_temp
         else:
-            value = 30*np.sin(2 * np.pi * self.f * self.ctr) + 40
+            value = 30*math.sin(2 * math.pi * self.f * self.ctr) + 40
             self.ctr += 1
             return value        
 
 if __name__ == "__main__":
 
+    # Log to a new file in the logs directory
+    log_dir = setup_logging("SENSOR", parent_dir)
+
     # Specify configuration file
     cfg = os.path.join(parent_dir, "cfg", "watches_cfg.json")
     
     # Create a digital sensor object to mirror our physical one
     sensor = temp_sensor_interface(cfg)
     
+    # On demand profiling, triggered with SIGUSR1/SIGUSR2
+    profiler = profiling_hooks("SENSOR", log_dir, sensor.config)
+    profiler.register(sensor, ["c_to_f", "add_topic"])
+    profiler.register(sensor.sensor1, ["get_temperature"])
+    profiler.install()
+    
     # Run the sensor
     try:
         sensor.run()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import math
+
+class rolling_stats:
+    """Mean and variance over the last N samples, updated in O(1) per sample
+    """
+
+    def __init__(self, size:int) -> None:
+        """Construct a rolling statistics window
+
+        Args:
+            size (int): Number of samples in the window
+        """
+        self.size = size
+        self.buffer = [0.0] * size
+        self.idx = 0
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def push(self, value:float) -> None:
+        """Add a sample, evicting the oldest one once the window is full
+
+        Args:
+            value (float): New sample
+        """
+        if self.n < self.size:
+            # Welford's update while the window fills
+            self.n += 1
+            delta = value - self.mean
+            self.mean += delta / self.n
+            self._m2 += delta * (value - self.mean)
+        else:
+            # Replace the oldest sample in place, keeping the sample count fixed
+            old = self.buffer[self.idx]
+            old_mean = self.mean
+            self.mean += (value - old) / self.n
+            self._m2 += (value - old) * (value - self.mean + old - old_mean)
+
+        self.buffer[self.idx] = value
+        self.idx = (self.idx + 1) % self.size
+
+    @property
+    def variance(self) -> float:
+        """Sample variance of the window, NaN until two samples have arrived
+        """
+        if self.n < 2:
+            return math.nan
+
+        return max(self._m2, 0.0) / (self.n - 1)
+
+class rolling_trend:
+    """Least squares line through the last N (time, value) samples, updated in O(1) per sample
+    """
+
+    def __init__(self, size:int) -> None:
+        """Construct a rolling trend window
+
+        Args:
+            size (int): Number of samples in the window
+        """
+        self.size = size
+        self.times = [0.0] * size
+        self.values = [0.0] * size
+        self.idx = 0
+        self.n = 0
+        self._pushes = 0
+        self._t0 = 0.0
+        self._st = self._stt = self._sv = self._stv = 0.0
+
+    def push(self, t:float, value:float) -> None:
+        """Add a sample, evicting the oldest one once the window is full
+
+        Args:
+            t (float): Sample time in seconds
+            value (float): Sample value
+        """
+        if self.n == self.size:
+            old_t, old_v = self.times[self.idx] - self._t0, self.values[self.idx]
+            self._st -= old_t
+            self._stt -= old_t * old_t
+            self._sv -= old_v
+            self._stv -= old_t * old_v
+        else:
+            if self.n == 0:
+                # Measure times from the first sample, so monotonic clock offsets don't swamp the sums
+                self._t0 = t
+            self.n += 1
+
+        self.times[self.idx] = t
+        self.values[self.idx] = value
+        self.idx = (self.idx + 1) % self.size
+
+        self._pushes += 1
+        if self._pushes >= self.size:
+            # Once per window length, rebase the time origin and re-sum from scratch. This keeps
+            # the running sums from drifting, at amortized O(1) cost.
+            self._rebase()
+        else:
+            rel_t = t - self._t0
+            self._st += rel_t
+            self._stt += rel_t * rel_t
+            self._sv += value
+            self._stv += rel_t * value
+
+    def _rebase(self) -> None:
+        """Recompute the running sums relative to the oldest sample in the window
+        """
+        order = [(self.idx - self.n + k) % self.size for k in range(self.n)]
+        self._t0 = self.times[order[0]]
+        self._st = self._stt = self._sv = self._stv = 0.0
+
+        for k in order:
+            rel_t = self.times[k] - self._t0
+            self._st += rel_t
+            self._stt += rel_t * rel_t
+            self._sv += self.values[k]
+            self._stv += rel_t * self.values[k]
+
+        self._pushes = 0
+
+    @property
+    def slope(self) -> float:
+        """Slope of the fitted line in value units per second, NaN until it is defined
+        """
+        denom = self.n * self._stt - self._st * self._st
+        if self.n < 2 or denom <= 0:
+            return math.nan
+
+        return (self.n * self._stv - self._st * self._sv) / denom
+
+    def predict(self, t:float) -> float:
+        """Evaluate the fitted line at a time
+
+        Args:
+            t (float): Time in seconds
+
+        Returns:
+            float: Projected value, NaN until the trend is defined
+        """
+        slope = self.slope
+        if math.isnan(slope):
+            return math.nan
+
+        mean_t = self._st / self.n
+        mean_v = self._sv / self.n
+
+        return mean_v + slope * (t - self._t0 - mean_t)
+
+class stream_analytics:
+    """Incremental statistics and fault detection over the temperature stream. Every update
+    costs O(1) regardless of window sizes, and the temperature log is never rescanned.
+    """
+
+    def __init__(self, config:dict) -> None:
+        """Construct the analytics stage from the WATCHES configuration
+
+        Args:
+            config (dict): WATCHES configuration
+        """
+        self.stats = rolling_stats(config.get("analytics_window", 300))
+        self.trend = rolling_trend(config.get("rate_window", 60))
+        self.duty = rolling_stats(config.get("duty_cycle_window", 3600))
+
+        self.flatline_samples = config.get("flatline_samples", 600)
+        self.flatline_epsilon = config.get("flatline_epsilon", 0.0)
+        self.max_heating_rate = config.get("max_heating_rate")
+        self.max_duty_cycle = config.get("max_duty_cycle")
+
+        self.last_value = None
+        self.flat_count = 0
+        self.alerts = dict(flatline=False, heating_rate=False, duty_cycle=False)
+
+    def update(self, t:float, temp_reading:float, fan_on:bool) -> list:
+        """Feed one temperature sample through the analytics stage
+
+        Args:
+            t (float): Sample time in seconds
+            temp_reading (float): Temperature reading
+            fan_on (bool): Whether the fan relay is reported on
+
+        Returns:
+            list: (alert name, raised, value) for every alert that changed state
+        """
+        self.stats.push(temp_reading)
+        self.trend.push(t, temp_reading)
+        self.duty.push(1.0 if fan_on else 0.0)
+
+        # Count consecutive readings that did not move
+        if self.last_value is not None and abs(temp_reading - self.last_value) <= self.flatline_epsilon:
+            self.flat_count += 1
+        else:
+            self.flat_count = 0
+        self.last_value = temp_reading
+
+        changes = []
+        self._check(changes, "flatline", self.flat_count >= self.flatline_samples,
+                    self.flat_count < self.flatline_samples, self.flat_count)
+
+        rate = self.rate_of_change
+        if self.max_heating_rate is not None and not math.isnan(rate):
+            # Clear below 80% of the limit so a rate hovering at the threshold doesn't chatter
+            self._check(changes, "heating_rate", rate > self.max_heating_rate,
+                        rate <= 0.8 * self.max_heating_rate, round(rate, 2))
+
+        if self.max_duty_cycle is not None and self.duty.n == self.duty.size:
+            self._check(changes, "duty_cycle", self.duty_cycle > self.max_duty_cycle,
+                        self.duty_cycle <= self.max_duty_cycle, round(self.duty_cycle, 3))
+
+        return changes
+
+    def _check(self, changes:list, name:str, raise_cond:bool, clear_cond:bool, value) -> None:
+        """Raise or clear an alert, recording the change if its state flipped
+        """
+        if not self.alerts[name] and raise_cond:
+            self.alerts[name] = True
+            changes.append((name, True, value))
+        elif self.alerts[name] and clear_cond:
+            self.alerts[name] = False
+            changes.append((name, False, value))
+
+    @property
+    def mean(self) -> float:
+        """Rolling mean temperature
+        """
+        return self.stats.mean
+
+    @property
+    def variance(self) -> float:
+        """Rolling temperature variance
+        """
+        return self.stats.variance
+
+    @property
+    def rate_of_change(self) -> float:
+        """Temperature trend in degrees per minute
+        """
+        return self.trend.slope * 60
+
+    @property
+    def duty_cycle(self) -> float:
+        """Fraction of recent samples taken with the fan on
+        """
+        return self.duty.mean
+
+    def summary(self) -> dict:
+        """Current statistics, for logging or display
+
+        Returns:
+            dict: Mean, variance, rate of change, duty cycle and flatline count
+        """
+        return dict(mean=self.mean, variance=self.variance, rate_of_change=self.rate_of_change,
+                    duty_cycle=self.duty_cycle, flat_count=self.flat_count)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import zmq
+import time
+import sys, os
+import logging
+import json
+
+from watches_logging import setup_logging
+from watches_sockets import ZONE_SEPARATOR, base_topic
+
+# Logging is configured in __main__, so importing this module has no side effects
+parent_dir = os.path.split(os.getcwd())[0]
+
+logger = logging.getLogger('WATCHES-BROKER')
+
+class watches_broker:
+    """A forwarding broker between WATCHES publishers and subscribers. Sensor and relay nodes publish
+    to the broker frontend (XSUB). Plant managers and viewers subscribe to a backend (XPUB). Topics
+    carrying a zone prefix ("garage/temp") are routed to that zone's backend, everything else goes to
+    the default backend.
+    """
+
+    def __init__(self, config_fname:str) -> None:
+        """Construct a WATCHES broker object
+
+        Args:
+            config_fname (str): Path to config file
+        """
+        # Load config file
+        self.load_cfg(config_fname)
+
+        self.zone_separator = ZONE_SEPARATOR.encode()
+        self.default_zone = b""
+        self.stats_interval = self.config.get("broker_stats_interval", 60)
+        self.lvc = self.config.get("broker_lvc", False)
+        # Cached values older than a few update periods are stale, e.g. from a node that has since died
+        self.lvc_max_age = self.config.get("broker_lvc_max_age",
+            3 * max(self.config.get("temp_update_rate", 1), self.config.get("fan_update_rate", 10)))
+
+        self._ctx = zmq.Context()
+
+        # Publishers connect here
+        self.frontend = self._ctx.socket(zmq.XSUB)
+        self.frontend.bind(str(self.config.get("broker_frontend")))
+
+        # One subscriber facing socket per zone, plus the default one
+        zones = dict(self.config.get("broker_zones") or {})
+        zones[self.default_zone.decode()] = self.config.get("broker_backend")
+
+        self.backends = {}
+        for zone, endpoint in zones.items():
+            backend = self._ctx.socket(zmq.XPUB)
+            if self.lvc:
+                # Pass on every subscription, not just the first for a topic, so each new subscriber gets a replay
+                backend.setsockopt(zmq.XPUB_VERBOSE, 1)
+            backend.bind(str(endpoint))
+            self.backends[zone.encode()] = backend
+            logger.info(f"Zone '{zone or 'default'}' served on {endpoint}")
+
+        # Optionally copy all traffic to a capture socket for recording or debugging
+        self.capture = None
+        if self.config.get("broker_capture"):
+            self.capture = self._ctx.socket(zmq.PUB)
+            self.capture.bind(str(self.config.get("broker_capture")))
+            logger.info(f"Capturing traffic on {self.config.get('broker_capture')}")
+
+        # Per zone message and byte counters
+        self.counters = {zone: dict(messages=0, bytes=0) for zone in self.backends}
+        
+        # Last-value cache: newest message of every latest-value topic with its receive time, per zone.
+        # Commands are never cached, a stale one replayed to a restarted node would override its restored state.
+        self.last_values = {zone: {} for zone in self.backends}
+        self.lvc_topics = {topic for topic, policy in self.config.get("socket_policies", {}).items() if policy.get("conflate")}
+        if self.lvc:
+            logger.info(f"Last-value cache enabled for {sorted(self.lvc_topics)}, max age {self.lvc_max_age} s")
+
+        logger.info("Broker initialized")
+
+    def load_cfg(self, config_fname:str) -> None:
+        """ Read the config JSON in as a struct
+
+        Args:
+            config_fname (str): Config filepath
+        """
+        with open(config_fname) as f:
+            cfg_file = json.load(f)
+
+        self.config = cfg_file.get("config")
+
+    def zone_of(self, frame:bytes) -> bytes:
+        """Determine which zone a message belongs to from its topic prefix
+
+        Args:
+            frame (bytes): First frame of the message
+
+        Returns:
+            bytes: Zone name, or the default zone if the topic has no known zone prefix
+        """
+        topic = frame.split(b'::', 1)[0]
+        zone = topic.split(self.zone_separator, 1)[0] if self.zone_separator in topic else self.default_zone
+
+        return zone if zone in self.backends else self.default_zone
+
+    def run(self) -> None:
+        """Forward messages downstream and subscriptions upstream until interrupted
+        """
+        logger.info("Entering run loop")
+
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        for backend in self.backends.values():
+            poller.register(backend, zmq.POLLIN)
+
+        last_report = time.monotonic()
+
+        while True:
+            events = dict(poller.poll(1000))
+
+            if self.frontend in events:
+                self.forward_messages()
+
+            # Subscriptions from any backend are forwarded upstream so publishers see them
+            for zone, backend in self.backends.items():
+                if backend in events:
+                    self.forward_subscriptions(zone, backend)
+
+            if time.monotonic() - last_report >= self.stats_interval:
+                self.report_stats(time.monotonic() - last_report)
+                last_report = time.monotonic()
+
+    def forward_messages(self) -> None:
+        """Drain the frontend, routing each message to its zone's backend
+        """
+        while True:
+            try:
+                msg = self.frontend.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+            zone = self.zone_of(msg[0])
+            self.backends[zone].send_multipart(msg)
+
+            counter = self.counters[zone]
+            counter["messages"] += 1
+            counter["bytes"] += sum(len(frame) for frame in msg)
+            
+            topic = msg[0].split(b'::', 1)[0]
+            if self.lvc and base_topic(topic.decode(errors='replace')) in self.lvc_topics:
+                self.last_values[zone][topic] = (time.monotonic(), msg)
+
+            if self.capture is not None:
+                self.capture.send_multipart(msg)
+
+    def forward_subscriptions(self, zone:bytes, backend:zmq.Socket) -> None:
+        """Drain subscription changes from a backend and pass them to the frontend. With the
+        last-value cache on, a new subscription is immediately answered with the newest cached
+        message of every topic it matches, unless that message is older than the maximum age.
+
+        Args:
+            zone (bytes): Zone the backend serves
+            backend (zmq.Socket): Backend with pending subscription messages
+        """
+        while True:
+            try:
+                sub = backend.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+            self.frontend.send_multipart(sub)
+
+            # Subscription messages are a 1 (subscribe) or 0 (unsubscribe) byte followed by the prefix
+            if self.lvc and sub[0][:1] == b'\x01':
+                prefix = sub[0][1:]
+                now = time.monotonic()
+                for received, msg in list(self.last_values[zone].values()):
+                    if msg[0].startswith(prefix) and now - received <= self.lvc_max_age:
+                        backend.send_multipart(msg)
+
+    def report_stats(self, elapsed:float) -> None:
+        """Log per zone throughput since the last report, then reset the counters
+
+        Args:
+            elapsed (float): Seconds since the last report
+        """
+        for zone, counter in self.counters.items():
+            logger.info(f"Zone '{zone.decode() or 'default'}': {counter['messages']} msgs "
+                        f"({counter['messages'] / elapsed:.1f} msg/s, {counter['bytes'] / elapsed:.0f} B/s)")
+            counter["messages"] = 0
+            counter["bytes"] = 0
+
+    def exit(self):
+        """Gracefully shutdown zmq ports and exit the program
+        """
+        logger.info("Gracefully exiting")
+        self.frontend.close()
+        for backend in self.backends.values():
+            backend.close()
+        if self.capture is not None:
+            self.capture.close()
+        self._ctx.term()
+        print("\nshutdown")
+        sys.exit(0)
+
+if __name__ == "__main__":
+
+    # Log to a new file in the logs directory
+    setup_logging("BROKER", parent_dir)
+
+    # Specify configuration file
+    cfg = os.path.join(parent_dir, "cfg", "watches_cfg.json")
+
+    broker = watches_broker(cfg)
+
+    # Handle exits
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        logger.info("Got shutdown signal")
+        broker.exit()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import time
+
+from watches_analytics import rolling_trend
+
+logger = logging.getLogger('WATCHES-CONTROL')
+
+class predictive_control:
+    """Fan control that looks ahead. A rolling least squares trend of the temperature is projected
+    forward by a lead time, and the fan switches as soon as the projection crosses the set point
+    (on) or the set point less the hysteresis (off), instead of waiting for the reading itself to
+    cross. Minimum on and off times stop the relay from short cycling. Every update costs O(1).
+    """
+
+    def __init__(self, config:dict) -> None:
+        """Construct the controller from the WATCHES configuration
+
+        Args:
+            config (dict): WATCHES configuration
+        """
+        self.upper = config.get("set_point")
+        self.lower = config.get("set_point") - config.get("hysteresis")
+        self.lead_time = config.get("predict_lead_time", 30)
+        self.min_on_time = config.get("min_on_time", 60)
+        self.min_off_time = config.get("min_off_time", 60)
+        self.trend = rolling_trend(config.get("trend_window", 60))
+
+        # Decided fan state, taken from the relay on the first update
+        self.fan_on = None
+        self.last_switch = -math.inf
+
+    def save(self) -> dict:
+        """Controller state to keep across a restart, so the minimum on and off times still hold.
+        The last switch is saved as a wall clock time, the monotonic clock does not survive a reboot.
+
+        Returns:
+            dict: JSON serializable state
+        """
+        if math.isinf(self.last_switch):
+            return dict(last_switch=None)
+
+        return dict(last_switch=time.time() - (time.monotonic() - self.last_switch))
+
+    def restore(self, saved:dict) -> None:
+        """Resume from saved controller state
+
+        Args:
+            saved (dict): State returned by save
+        """
+        last_switch = saved.get("last_switch")
+        if last_switch is not None:
+            # Never in the future, in case the wall clock stepped back since
+            self.last_switch = min(time.monotonic() - (time.time() - last_switch), time.monotonic())
+
+    def projected(self, t:float) -> float:
+        """Temperature projected one lead time ahead, NaN until the trend window has filled
+
+        Args:
+            t (float): Current time in seconds
+
+        Returns:
+            float: Projected temperature
+        """
+        if self.trend.n < self.trend.size:
+            return math.nan
+
+        return self.trend.predict(t + self.lead_time)
+
+    def update(self, t:float, temp_reading:float, fan_on:bool) -> bool:
+        """Feed one temperature sample through the controller and decide the fan state
+
+        Args:
+            t (float): Sample time in seconds, from a monotonic clock
+            temp_reading (float): Temperature reading
+            fan_on (bool): Whether the fan relay is reported on
+
+        Returns:
+            bool: True if the fan should be on
+        """
+        self.trend.push(t, temp_reading)
+        if self.fan_on is None:
+            self.fan_on = fan_on
+
+        # NaN compares False, so without a trend this is the plain threshold controller
+        projected = self.projected(t)
+        elapsed = t - self.last_switch
+
+        if self.fan_on:
+            if (temp_reading <= self.lower or projected <= self.lower) and elapsed >= self.min_on_time:
+                self.switch(t, False, temp_reading, projected)
+        else:
+            if (temp_reading > self.upper or projected > self.upper) and elapsed >= self.min_off_time:
+                self.switch(t, True, temp_reading, projected)
+
+        return self.fan_on
+
+    def switch(self, t:float, fan_on:bool, temp_reading:float, projected:float) -> None:
+        """Record a decided fan state change
+
+        Args:
+            t (float): Time of the change in seconds
+            fan_on (bool): New fan state
+            temp_reading (float): Reading that triggered the change
+            projected (float): Projected temperature at the change
+        """
+        self.fan_on = fan_on
+        self.last_switch = t
+
+        threshold = self.upper if fan_on else self.lower
+        crossed = temp_reading > threshold if fan_on else temp_reading <= threshold
+        if not crossed:
+            logger.info(f"Switching fan {'on' if fan_on else 'off'} early: {temp_reading:.1f} degF now, "
+                        f"{projected:.1f} degF projected in {self.lead_time} s")
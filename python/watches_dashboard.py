@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+logger = logging.getLogger('WATCHES-DASHBOARD')
+
+# Single page served to the browser. The page pulls a downsampled snapshot once, then
+# appends every delta it receives over Server-Sent Events and redraws on a canvas.
+DASHBOARD_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>WATCHES - Return Temperature</title>
+<style>
+  body { font-family: sans-serif; margin: 1em; background: #fafafa; }
+  #status { margin-bottom: 0.5em; }
+  canvas { background: white; border: 1px solid #ccc; width: 100%; height: 70vh; }
+</style>
+</head>
+<body>
+<div id="status">Connecting...</div>
+<canvas id="plot"></canvas>
+<script>
+const DAY = 60 * 60 * 24;
+const temps = new Float32Array(DAY).fill(NaN);
+let cfg = null, current = null, fan = {commanded: "?", reported: "?"}, dirty = false;
+
+function applySnapshot(snap) {
+  cfg = snap;
+  temps.fill(NaN);
+  snap.values.forEach((v, i) => {
+    if (v === null) return;
+    for (let k = 0; k < snap.bin_seconds; k++) temps[i * snap.bin_seconds + k] = v;
+  });
+  current = snap.current;
+  fan = snap.fan;
+  dirty = true;
+}
+
+function draw() {
+  requestAnimationFrame(draw);
+  if (!dirty || cfg === null) return;
+  dirty = false;
+  const c = document.getElementById("plot");
+  c.width = c.clientWidth; c.height = c.clientHeight;
+  const g = c.getContext("2d"), pad = 40, w = c.width - 2 * pad, h = c.height - 2 * pad;
+  const x = t => pad + w * t / DAY;
+  const y = v => pad + h * (cfg.upper - v) / (cfg.upper - cfg.lower);
+  g.clearRect(0, 0, c.width, c.height);
+  g.strokeStyle = "#ddd"; g.fillStyle = "black";
+  for (let hr = 0; hr < 24; hr++) {
+    g.beginPath(); g.moveTo(x(hr * 3600), pad); g.lineTo(x(hr * 3600), pad + h); g.stroke();
+    g.fillText(String(hr).padStart(2, "0") + "00", x(hr * 3600) - 10, pad + h + 15);
+  }
+  [[cfg.set_point, "#008000"], [cfg.set_point - cfg.hysteresis, "black"]].forEach(([v, col]) => {
+    g.strokeStyle = col; g.beginPath(); g.moveTo(x(0), y(v)); g.lineTo(x(DAY), y(v)); g.stroke();
+  });
+  g.strokeStyle = "blue"; g.beginPath();
+  let pen = false;
+  for (let t = 0; t < DAY; t++) {
+    const v = temps[t];
+    if (isNaN(v)) { pen = false; continue; }
+    if (pen) g.lineTo(x(t), y(v)); else g.moveTo(x(t), y(v));
+    pen = true;
+  }
+  g.stroke();
+  if (current !== null) {
+    g.fillStyle = "red";
+    g.fillRect(x(current.t) - 4, y(current.v) - 4, 8, 8);
+  }
+  document.getElementById("status").textContent =
+    (current === null ? "No readings yet" : "Current reading: " + current.v.toFixed(1) + " F") +
+    " | Fan commanded: " + fan.commanded + " | Fan reported: " + fan.reported;
+}
+
+function loadSnapshot() {
+  return fetch("snapshot").then(r => r.json()).then(applySnapshot);
+}
+
+loadSnapshot().then(() => {
+  const es = new EventSource("stream");
+  let lost = false;
+  es.addEventListener("reading", e => {
+    const d = JSON.parse(e.data);
+    temps[d.t] = d.v; current = d; dirty = true;
+  });
+  es.addEventListener("fan", e => { Object.assign(fan, JSON.parse(e.data)); dirty = true; });
+  es.onerror = () => { lost = true; document.getElementById("status").textContent = "Disconnected, retrying..."; };
+  // Updates may have been missed while disconnected, so start again from a fresh snapshot
+  es.onopen = () => { if (lost) { lost = false; loadSnapshot(); } };
+  requestAnimationFrame(draw);
+});
+</script>
+</body>
+</html>
+"""
+
+def bin_size(length:int, bins:int) -> int:
+    """Samples per bin when reducing a log to at most a number of bins
+
+    Args:
+        length (int): Length of the log
+        bins (int): Requested number of bins
+
+    Returns:
+        int: Samples per bin, the last bin may be partly empty
+    """
+    return -(-length // max(1, min(bins, length)))
+
+def downsample(values:np.ndarray, bins:int) -> list:
+    """Reduce a NaN padded log to the mean of each of at most a fixed number of bins. When the
+    bins don't divide the log evenly, the last bin holds the leftover samples.
+
+    Args:
+        values (np.ndarray): Input log, NaN where no reading exists
+        bins (int): Requested number of output points
+
+    Returns:
+        list: Mean of each bin, None where a bin holds no readings
+    """
+    values = np.asarray(values, dtype=float)
+    size = bin_size(len(values), bins)
+
+    # Pad the leftover bin out with missing readings
+    values = np.concatenate([values, np.full(-len(values) % size, np.nan)])
+    valid = ~np.isnan(values)
+
+    # Sum and count manually so that empty bins don't raise all-NaN warnings
+    sums = np.where(valid, values, 0.0).reshape(-1, size).sum(axis=1)
+    counts = valid.reshape(-1, size).sum(axis=1)
+
+    return [round(float(s / n), 2) if n else None for s, n in zip(sums, counts)]
+
+class watches_dashboard:
+    """A small web server that replaces the matplotlib window when the plant manager runs headless.
+    Viewers get a downsampled snapshot on page load, and append-only deltas afterwards.
+    """
+
+    def __init__(self, host:str, port:int, snapshot_fn, client_queue_size:int=1000) -> None:
+        """Construct a WATCHES dashboard object
+
+        Args:
+            host (str): Interface to serve the dashboard on
+            port (int): TCP port to serve the dashboard on
+            snapshot_fn (callable): Returns a JSON serializable dict describing the current plot
+            client_queue_size (int): Number of pending deltas kept per viewer before its stream is closed
+        """
+        self.host = host
+        self.port = port
+        self.snapshot_fn = snapshot_fn
+        self.client_queue_size = client_queue_size
+
+        # One queue of pending events per connected viewer
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def start(self) -> None:
+        """Start serving the dashboard from a background thread
+        """
+        dashboard = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                dashboard._handle(self)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+        logger.info(f"Dashboard serving on http://{self.host}:{self.port}/")
+
+    def publish(self, event:str, data:dict) -> None:
+        """Push a delta to every connected viewer
+
+        Args:
+            event (str): SSE event name
+            data (dict): JSON serializable event payload
+        """
+        # Encode once, no matter how many viewers are connected
+        frame = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+        with self._lock:
+            clients = list(self._clients)
+
+        for client in clients:
+            try:
+                client.put_nowait(frame)
+            except queue.Full:
+                # A stalled viewer must never block the control loop. Close its stream instead, the
+                # page reconnects and reloads the snapshot, so no update is silently lost.
+                logger.warning("Dashboard viewer fell behind, closing its stream")
+                with self._lock:
+                    self._clients.discard(client)
+
+                # Make room for the end of stream marker. Nothing else puts to this queue any more.
+                try:
+                    client.get_nowait()
+                except queue.Empty:
+                    pass
+                client.put_nowait(None)
+
+    def stop(self) -> None:
+        """Shut the web server down
+        """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+        logger.info("Dashboard stopped")
+
+    def _handle(self, request:BaseHTTPRequestHandler) -> None:
+        """Route a GET request
+
+        Args:
+            request (BaseHTTPRequestHandler): The request being served
+        """
+        path = request.path.split('?')[0]
+
+        if path in ('/', '/index.html'):
+            self._send(request, 'text/html; charset=utf-8', DASHBOARD_PAGE.encode())
+        elif path == '/snapshot':
+            self._send(request, 'application/json', json.dumps(self.snapshot_fn()).encode())
+        elif path == '/stream':
+            self._stream(request)
+        else:
+            request.send_error(404)
+
+    def _send(self, request:BaseHTTPRequestHandler, content_type:str, body:bytes) -> None:
+        """Send a complete response
+
+        Args:
+            request (BaseHTTPRequestHandler): The request being served
+            content_type (str): MIME type of the body
+            body (bytes): Response body
+        """
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('Cache-Control', 'no-cache')
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _stream(self, request:BaseHTTPRequestHandler) -> None:
+        """Hold a Server-Sent Events connection open and forward deltas until the viewer leaves
+
+        Args:
+            request (BaseHTTPRequestHandler): The request being served
+        """
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/event-stream')
+        request.send_header('Cache-Control', 'no-cache')
+        request.end_headers()
+
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            self._clients.add(client)
+        logger.info(f"Dashboard viewer connected from {request.client_address[0]}")
+
+        try:
+            request.wfile.write(b"retry: 2000\n\n")
+            request.wfile.flush()
+
+            while True:
+                try:
+                    frame = client.get(timeout=15)
+                except queue.Empty:
+                    # Keep idle connections from being closed by proxies
+                    frame = b": keepalive\n\n"
+
+                if frame is None:
+                    # The viewer fell behind and updates were dropped, end the stream so it resyncs
+                    break
+
+                request.wfile.write(frame)
+                request.wfile.flush()
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+            logger.info(f"Dashboard viewer disconnected from {request.client_address[0]}")
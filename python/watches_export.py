@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import gzip
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from datetime import datetime as dt
+
+import numpy as np
+
+from watches_ingest import UNKNOWN, history_store, log_files, parse_events, read_lines, store_dir
+
+logger = logging.getLogger('WATCHES-EXPORT')
+
+parent_dir = os.path.split(os.getcwd())[0]
+log_dir = os.path.join(parent_dir, "logs")
+
+# Columns of an exported history, in output order. Fan columns are encoded as
+# 1 = on, 0 = off, 2 = error, -1 = unknown (nothing seen yet)
+COLUMNS = dict(time=np.float64, temp_f=np.float32, fan_command=np.int8, fan_state=np.int8)
+
+# History series feeding each event kind of the export
+SERIES_KINDS = dict(temp="temp", fan_command="command", fan_state="state")
+
+def log_events(directory:str=log_dir, start:float=None, end:float=None):
+    """Stream control events straight out of the plant manager logs
+
+    Args:
+        directory (str): Directory containing the WATCHES logs
+        start (float): Drop readings before this epoch time
+        end (float): Drop events after this epoch time
+
+    Yields:
+        tuple: (epoch time, kind, value) with kind one of "temp", "command", "state"
+    """
+    for path in log_files(directory, "PLANTMANAGER"):
+        lines = (line for line, _ in read_lines(path))
+
+        for t, series, value in parse_events(lines, "PLANTMANAGER"):
+            if series not in SERIES_KINDS:
+                continue
+            # Commands and states from before the range still set the fan columns of the first rows
+            if start is not None and t < start and series == "temp":
+                continue
+            if end is not None and t > end:
+                break
+
+            yield t, SERIES_KINDS[series], value
+
+def store_events(store:history_store, start:float=None, end:float=None, window:float=24*60*60):
+    """Stream control events out of an ingested history store, one window of time at a time
+
+    Args:
+        store (history_store): Store written by watches_ingest
+        start (float): Drop readings before this epoch time
+        end (float): Drop events after this epoch time
+        window (float): Seconds of history held in memory at once
+
+    Yields:
+        tuple: (epoch time, kind, value)
+    """
+    first, last = store.bounds()
+    if first is None:
+        return
+
+    start = first if start is None else max(start, first)
+    end = last if end is None else min(end, last)
+
+    # Seed the fan columns with the last command and state from before the range
+    for series in ("fan_command", "fan_state"):
+        times, values = store.query(series, None, np.nextafter(start, -np.inf))
+        if len(times):
+            yield float(times[-1]), SERIES_KINDS[series], int(values[-1])
+
+    window_start = start
+    while window_start <= end:
+        window_end = min(window_start + window, end)
+
+        # Merge the series by time, keeping events from the same second in series order
+        parts = [(store.query(series, window_start, window_end), kind) for series, kind in SERIES_KINDS.items()]
+        times = np.concatenate([p[0][0] for p in parts])
+        values = np.concatenate([p[0][1] for p in parts])
+        kinds = np.concatenate([np.full(len(p[0][0]), i) for i, p in enumerate(parts)])
+        kind_names = [p[1] for p in parts]
+
+        for i in np.argsort(times, kind='stable'):
+            kind = kind_names[kinds[i]]
+            value = float(values[i]) if kind == "temp" else int(values[i])
+            yield float(times[i]), kind, value
+
+        # Query bounds are inclusive, so step just past the end of this window
+        window_start = np.nextafter(window_end, np.inf)
+
+def align_history(events, chunk_rows:int=65536):
+    """Align fan commands and reported fan states to the temperature timeline. Each temperature
+    sample carries the most recent command and state seen before it.
+
+    Args:
+        events (iterable): (epoch time, kind, value) tuples in time order
+        chunk_rows (int): Maximum number of rows per yielded chunk
+
+    Yields:
+        dict: One numpy array per entry of COLUMNS
+    """
+    command, state = UNKNOWN, UNKNOWN
+    rows = []
+
+    for t, kind, value in events:
+        if kind == "command":
+            command = value
+        elif kind == "state":
+            state = value
+        else:
+            rows.append((t, value, command, state))
+
+            if len(rows) >= chunk_rows:
+                yield to_columns(rows)
+                rows = []
+
+    if rows:
+        yield to_columns(rows)
+
+def to_columns(rows:list) -> dict:
+    """Transpose a list of row tuples into typed column arrays
+
+    Args:
+        rows (list): Row tuples in COLUMNS order
+
+    Returns:
+        dict: One numpy array per entry of COLUMNS
+    """
+    return {name: np.array(col, dtype=dtype) for (name, dtype), col in zip(COLUMNS.items(), zip(*rows))}
+
+def write_csv(chunks, out_path:str) -> int:
+    """Write history chunks to CSV, gzip compressed if the path ends in .gz
+
+    Args:
+        chunks (iterable): Column chunks as produced by align_history
+        out_path (str): Output file path
+
+    Returns:
+        int: Number of rows written
+    """
+    opener = gzip.open if out_path.endswith('.gz') else open
+    n_rows = 0
+
+    with opener(out_path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS.keys())
+
+        for chunk in chunks:
+            # Round temperatures so float32 storage noise doesn't show up in the text
+            columns = [chunk[name].astype(np.float64).round(3) if name == "temp_f" else chunk[name] for name in COLUMNS]
+            writer.writerows(zip(*(col.tolist() for col in columns)))
+            n_rows += len(chunk["time"])
+
+    return n_rows
+
+def write_npz(chunks, out_path:str) -> int:
+    """Write history chunks to a compressed .npz that np.load reads like any other. Columns
+    are spooled to disk first so that memory use stays bounded by the chunk size.
+
+    Args:
+        chunks (iterable): Column chunks as produced by align_history
+        out_path (str): Output file path
+
+    Returns:
+        int: Number of rows written
+    """
+    n_rows = 0
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as spool_dir:
+        spools = {name: open(os.path.join(spool_dir, name), 'wb') for name in COLUMNS}
+
+        for chunk in chunks:
+            for name, dtype in COLUMNS.items():
+                chunk[name].astype(dtype, copy=False).tofile(spools[name])
+            n_rows += len(chunk["time"])
+
+        for spool in spools.values():
+            spool.close()
+
+        with zipfile.ZipFile(out_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for name, dtype in COLUMNS.items():
+                header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (n_rows,)}
+
+                with zf.open(name + '.npy', 'w', force_zip64=True) as member, open(spools[name].name, 'rb') as raw:
+                    np.lib.format.write_array_header_1_0(member, header)
+                    shutil.copyfileobj(raw, member, 1024*1024)
+
+    return n_rows
+
+def write_parquet(chunks, out_path:str) -> int:
+    """Write history chunks to Parquet, one row group per chunk. Requires pyarrow.
+
+    Args:
+        chunks (iterable): Column chunks as produced by align_history
+        out_path (str): Output file path
+
+    Returns:
+        int: Number of rows written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype))) for name, dtype in COLUMNS.items()])
+    n_rows = 0
+
+    with pq.ParquetWriter(out_path, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pydict({name: chunk[name] for name in COLUMNS}, schema=schema))
+            n_rows += len(chunk["time"])
+
+    return n_rows
+
+WRITERS = dict(csv=write_csv, npz=write_npz, parquet=write_parquet)
+
+def infer_format(out_path:str) -> str:
+    """Guess the export format from the output file extension
+
+    Args:
+        out_path (str): Output file path
+
+    Returns:
+        str: One of the WRITERS keys
+    """
+    name = out_path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+
+    ext = os.path.splitext(name)[1].lstrip('.')
+    if ext == 'pq':
+        ext = 'parquet'
+    if ext not in WRITERS:
+        raise ValueError(f"Cannot infer export format from {out_path}, expected one of {list(WRITERS)}")
+
+    return ext
+
+def export_history(out_path:str, fmt:str=None, start:float=None, end:float=None,
+                   directory:str=log_dir, chunk_rows:int=65536, store:str=None) -> int:
+    """Stream the temperature and relay history to a file
+
+    Args:
+        out_path (str): Output file path
+        fmt (str): "npz", "parquet" or "csv". Inferred from out_path if None
+        start (float): Export from this epoch time on
+        end (float): Export up to this epoch time
+        directory (str): Directory containing the WATCHES logs
+        chunk_rows (int): Rows held in memory at once
+        store (str): Read from this ingested history store instead of parsing the logs
+
+    Returns:
+        int: Number of rows written
+    """
+    fmt = fmt or infer_format(out_path)
+
+    if store is not None:
+        events = store_events(history_store(store), start, end)
+    else:
+        events = log_events(directory, start, end)
+    chunks = align_history(events, chunk_rows)
+
+    n_rows = WRITERS[fmt](chunks, out_path)
+    logger.info(f"Exported {n_rows} rows to {out_path}")
+
+    return n_rows
+
+def parse_time(value:str) -> float:
+    """argparse helper turning an ISO 8601 local time into an epoch time
+    """
+    return dt.fromisoformat(value).timestamp()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export WATCHES temperature and fan history")
+    parser.add_argument("out", help="Output file (.npz, .parquet, .csv or .csv.gz)")
+    parser.add_argument("--format", choices=list(WRITERS), help="Output format, inferred from the file name by default")
+    parser.add_argument("--start", type=parse_time, help="Start of the time range, e.g. 2024-05-01T00:00")
+    parser.add_argument("--end", type=parse_time, help="End of the time range")
+    parser.add_argument("--log-dir", default=log_dir, help="Directory holding the WATCHES logs")
+    parser.add_argument("--chunk-rows", type=int, default=65536, help="Rows held in memory at once")
+    parser.add_argument("--store", nargs='?', const=store_dir, help="Read from the ingested history store instead of the logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    try:
+        export_history(args.out, args.format, args.start, args.end, args.log_dir, args.chunk_rows, args.store)
+    except (RuntimeError, ValueError) as e:
+        logger.error(e)
+        sys.exit(1)
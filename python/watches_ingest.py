@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime as dt
+
+import numpy as np
+
+logger = logging.getLogger('WATCHES-INGEST')
+
+parent_dir = os.path.split(os.getcwd())[0]
+log_dir = os.path.join(parent_dir, "logs")
+store_dir = os.path.join(parent_dir, "history")
+
+# Log line layout, matching the formatter every WATCHES daemon installs
+LOG_TIME_FORMAT = '%m/%d/%Y %I:%M:%S%p'
+SUBSECOND_STEP = 1e-4
+LINE_RE = re.compile(r'^(?P<time>\d\d/\d\d/\d{4} \d\d:\d\d:\d\d[AP]M) - (?P<name>\S+) - (?P<level>\w+) - (?P<msg>.*)$')
+
+# Fan states are stored as 1 = on, 0 = off, 2 = error, -1 = unknown
+FAN_CODES = dict(on=1, off=0, error=2)
+UNKNOWN = -1
+
+def fan_code(state:str) -> int:
+    """Encode a fan state string from a log message
+    """
+    return FAN_CODES.get(state.lower(), UNKNOWN)
+
+# Messages worth keeping from each daemon: (pattern, series, value from match)
+PATTERNS = dict(
+    PLANTMANAGER=[
+        (re.compile(r'^Got reading (?P<value>\S+) degF at time \d+ seconds$'), "temp", lambda m: float(m.group('value'))),
+        (re.compile(r'^Set Fan (?P<state>ON|OFF)$'), "fan_command", lambda m: fan_code(m.group('state'))),
+        (re.compile(r'^Got fan state (?P<state>\S+) from FANCONTROL$'), "fan_state", lambda m: fan_code(m.group('state'))),
+    ],
+    SENSOR=[
+        (re.compile(r'^Sensor Reading: (?P<value>\S+)$'), "sensor_temp", lambda m: float(m.group('value'))),
+        (re.compile(r'^Sensor error .*, reporting last sensor reading$'), "sensor_error", lambda m: 1),
+    ],
+    FANCONTROL=[
+        (re.compile(r'^(?:DEBUG MODE: )?Fan turned (?P<state>ON|OFF)$'), "relay", lambda m: fan_code(m.group('state'))),
+        (re.compile(r'^Unable to turn fan (?P<state>ON|OFF)\.$'), "relay_error", lambda m: fan_code(m.group('state'))),
+    ],
+)
+
+def log_files(directory:str, prefix:str) -> list:
+    """List the log files written by one daemon, oldest first. Rotated backups (.log.1)
+    hold older lines than the live file they were rotated out of.
+
+    Args:
+        directory (str): Directory containing the WATCHES logs
+        prefix (str): Daemon log prefix, e.g. PLANTMANAGER
+
+    Returns:
+        list: Ordered list of file paths
+    """
+    paths = glob.glob(os.path.join(directory, prefix + "-*.log")) + glob.glob(os.path.join(directory, prefix + "-*.log.1"))
+
+    return sorted(paths, key=lambda p: (p.rsplit('.log', 1)[0], not p.endswith('.1')))
+
+def read_lines(path:str, offset:int=0):
+    """Stream complete lines from a log, starting at a byte offset. A partially written
+    last line is left for the next pass.
+
+    Args:
+        path (str): Log file path
+        offset (int): Byte offset to start at
+
+    Yields:
+        tuple: (line, byte offset just past the line)
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                return
+            offset += len(raw)
+            yield raw.decode(errors='replace').rstrip('\n'), offset
+
+def parse_events(lines, prefix:str):
+    """Turn log lines into timestamped events
+
+    Args:
+        lines (iterable): Log lines
+        prefix (str): Daemon log prefix selecting the message patterns
+
+    Yields:
+        tuple: (epoch time, series, value)
+    """
+    patterns = PATTERNS[prefix]
+    last_stamp, last_time, n_in_second = None, None, 0
+
+    for line in lines:
+        line_match = LINE_RE.match(line)
+        if line_match is None:
+            continue
+
+        msg = line_match.group('msg')
+        for pattern, series, value_fn in patterns:
+            msg_match = pattern.match(msg)
+            if msg_match is None:
+                continue
+
+            # Lines arrive many per second, so only parse the timestamp when it changes
+            stamp = line_match.group('time')
+            if stamp != last_stamp:
+                last_stamp, last_time, n_in_second = stamp, dt.strptime(stamp, LOG_TIME_FORMAT).timestamp(), 0
+
+            # Log times only resolve whole seconds. Nudge events within a second apart so that
+            # sorting by time keeps the order they were logged in.
+            yield last_time + n_in_second * SUBSECOND_STEP, series, value_fn(msg_match)
+            n_in_second += 1
+            break
+
+def parse_log(path:str, prefix:str, offset:int=0) -> tuple:
+    """Parse everything a log gained since the last pass. Runs in a worker process.
+
+    Args:
+        path (str): Log file path
+        prefix (str): Daemon log prefix
+        offset (int): Byte offset reached by the last pass
+
+    Returns:
+        tuple: (new offset, dict of series name to (times, values) arrays)
+    """
+    progress = dict(offset=offset)
+
+    def lines():
+        for line, end in read_lines(path, offset):
+            progress["offset"] = end
+            yield line
+
+    columns = {}
+    for t, series, value in parse_events(lines(), prefix):
+        times, values = columns.setdefault(series, ([], []))
+        times.append(t)
+        values.append(value)
+
+    return progress["offset"], {series: (np.array(times, dtype=np.float64), np.array(values, dtype=np.float32))
+                        for series, (times, values) in columns.items()}
+
+class history_store:
+    """Columnar, time indexed store of the events parsed out of the WATCHES logs.
+
+    Each series is a pair of append-only files, <series>.time (float64 epoch seconds) and
+    <series>.value (float32). index.json records, for each series, segments of rows that are
+    sorted by time along with their time bounds, and the byte offset reached in every log file.
+    """
+
+    def __init__(self, path:str=store_dir) -> None:
+        """Open (or create) a history store
+
+        Args:
+            path (str): Store directory
+        """
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+        self.index_fname = os.path.join(self.path, "index.json")
+        if os.path.isfile(self.index_fname):
+            with open(self.index_fname) as f:
+                self.index = json.load(f)
+        else:
+            self.index = dict(files={}, series={})
+
+    def save_index(self) -> None:
+        """Atomically replace the index file
+        """
+        tmp_fname = self.index_fname + ".tmp"
+        with open(tmp_fname, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_fname, self.index_fname)
+
+    def rows(self, series:str) -> int:
+        """Number of rows committed to a series
+        """
+        return sum(seg[3] for seg in self.index["series"].get(series, []))
+
+    def append(self, series:str, times:np.ndarray, values:np.ndarray) -> None:
+        """Append a batch of events to a series. The index must be saved afterwards to commit.
+
+        Args:
+            series (str): Series name
+            times (np.ndarray): Epoch times
+            values (np.ndarray): Values, one per time
+        """
+        if not len(times):
+            return
+
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+
+        # Drop anything written past the last committed row by an interrupted run
+        n_rows = self.rows(series)
+        for ext, data in (("time", times), ("value", values)):
+            with open(os.path.join(self.path, f"{series}.{ext}"), 'ab') as f:
+                f.truncate(n_rows * data.itemsize)
+                data.tofile(f)
+
+        segments = self.index["series"].setdefault(series, [])
+        if segments and times[0] >= segments[-1][1]:
+            # The usual incremental case: new rows continue the last sorted segment
+            segments[-1][1] = float(times[-1])
+            segments[-1][3] += len(times)
+        else:
+            segments.append([float(times[0]), float(times[-1]), n_rows, len(times)])
+
+    def query(self, series:str, start:float=None, end:float=None) -> tuple:
+        """Read the events of a series within a time range
+
+        Args:
+            series (str): Series name
+            start (float): Inclusive start epoch time, unbounded if None
+            end (float): Inclusive end epoch time, unbounded if None
+
+        Returns:
+            tuple: (times, values) arrays sorted by time
+        """
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        n_rows = self.rows(series)
+        parts = []
+
+        if n_rows:
+            all_times = np.memmap(os.path.join(self.path, f"{series}.time"), dtype=np.float64, mode='r', shape=(n_rows,))
+            all_values = np.memmap(os.path.join(self.path, f"{series}.value"), dtype=np.float32, mode='r', shape=(n_rows,))
+
+            for t_min, t_max, row, count in self.index["series"][series]:
+                if t_max < start or t_min > end:
+                    continue
+
+                seg_times = all_times[row:row + count]
+                lo = row + np.searchsorted(seg_times, start, side='left')
+                hi = row + np.searchsorted(seg_times, end, side='right')
+                parts.append((np.array(all_times[lo:hi]), np.array(all_values[lo:hi])))
+
+        if not parts:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+
+        times = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        if len(parts) > 1:
+            order = np.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+
+        return times, values
+
+    def bounds(self) -> tuple:
+        """Earliest and latest event time across all series
+
+        Returns:
+            tuple: (start, end), or (None, None) if the store is empty
+        """
+        segments = [seg for segs in self.index["series"].values() for seg in segs]
+        if not segments:
+            return None, None
+
+        return min(seg[0] for seg in segments), max(seg[1] for seg in segments)
+
+    def ingest(self, directory:str=log_dir, workers:int=None) -> int:
+        """Parse whatever the logs gained since the last run and commit it to the store
+
+        Args:
+            directory (str): Directory containing the WATCHES logs
+            workers (int): Number of parser processes, one per CPU if None
+
+        Returns:
+            int: Number of events added
+        """
+        files = self.index["files"]
+        jobs = []
+
+        for prefix in PATTERNS:
+            for path in log_files(directory, prefix):
+                st = os.stat(path)
+
+                # Key on the inode so that a log keeps its offset when rotation renames it to .1
+                key = f"{st.st_dev}:{st.st_ino}"
+                offset = files.get(key, {}).get("offset", 0)
+                if offset > st.st_size:
+                    # Not the file we saw before (inode reused after deletion)
+                    offset = 0
+                jobs.append((key, path, prefix, offset, st.st_size))
+
+        pending = [job for job in jobs if job[3] < job[4]]
+        logger.info(f"Ingesting {len(pending)} of {len(jobs)} log files from {directory}")
+
+        batches = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(parse_log, [job[1] for job in pending], [job[2] for job in pending], [job[3] for job in pending])
+
+            for (key, path, *_), (offset, columns) in zip(pending, results):
+                files[key] = dict(name=os.path.basename(path), offset=offset)
+                for series, data in columns.items():
+                    batches.setdefault(series, []).append(data)
+
+        n_events = 0
+        for series, parts in batches.items():
+            times = np.concatenate([p[0] for p in parts])
+            values = np.concatenate([p[1] for p in parts])
+            self.append(series, times, values)
+            n_events += len(times)
+
+        # Forget logs that have been cleared away
+        live = {job[0] for job in jobs}
+        self.index["files"] = {key: entry for key, entry in files.items() if key in live}
+        self.save_index()
+
+        logger.info(f"Added {n_events} events to {self.path}")
+
+        return n_events
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest WATCHES logs into the history store")
+    parser.add_argument("--log-dir", default=log_dir, help="Directory holding the WATCHES logs")
+    parser.add_argument("--store", default=store_dir, help="History store directory")
+    parser.add_argument("--workers", type=int, help="Number of parser processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    history_store(args.store).ingest(args.log_dir, args.workers)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from datetime import datetime as dt, timedelta
+
+logger = logging.getLogger('WATCHES-JOURNAL')
+
+parent_dir = os.path.split(os.getcwd())[0]
+journal_dir = os.path.join(parent_dir, "journal")
+
+# One fixed size record per event: epoch time, event code, source daemon, value
+RECORD = struct.Struct('<dHHf')
+
+EVENTS = dict(fan_command=1, fan_state=2, fsm_state=3, sensor_error=4, relay_state=5)
+SOURCES = dict(PLANTMANAGER=1, FANCONTROL=2, SENSOR=3)
+
+# State values share the export encoding: 1 = on, 0 = off, 2 = error, 3 = warning
+STATES = dict(off=0, on=1, error=2, warning=3)
+
+EVENT_NAMES = {code: name for name, code in EVENTS.items()}
+SOURCE_NAMES = {code: name for name, code in SOURCES.items()}
+STATE_NAMES = {code: name for name, code in STATES.items()}
+
+class journal_writer:
+    """Append only journal of control events for one daemon, one file per day. Records go through
+    a buffered writer and are committed together (flush and fsync) at most once per fsync interval,
+    so a burst of events costs one disk sync and a crash loses at most one interval of events.
+
+    Readers binary search on time, so a file must stay in time order. If the wall clock steps back
+    (e.g. NTP correcting a Pi without an RTC after boot), records keep the latest time already
+    written until the clock catches up, and the step is logged.
+    """
+
+    def __init__(self, config:dict, name:str, directory:str=None) -> None:
+        """Construct a journal writer
+
+        Args:
+            config (dict): WATCHES configuration
+            name (str): Daemon name, a key of SOURCES, used for the file names
+            directory (str): Journal directory, the configured or default one if not given
+        """
+        self.dir = directory or config.get("journal_dir") or journal_dir
+        self.fsync_interval = config.get("journal_fsync_interval", 5)
+        self.name = name
+        self.source = SOURCES[name]
+
+        self.file = None
+        self.pending = 0
+        self.last_time = -math.inf
+        self._day_end = 0.0
+        self._last_commit = time.monotonic()
+
+        os.makedirs(self.dir, exist_ok=True)
+
+    def open_day(self, t:float) -> None:
+        """Commit the current file and start appending to the file for the day of a time
+
+        Args:
+            t (float): Epoch time
+        """
+        self.close()
+
+        day = dt.fromtimestamp(t).replace(hour=0, minute=0, second=0, microsecond=0)
+        fname = os.path.join(self.dir, f"{self.name}-{day.strftime('%Y-%m-%d')}.jnl")
+        # Next local midnight, a DST change makes the day 23 or 25 hours long
+        self._day_end = (day + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+        self.last_time = -math.inf
+        if os.path.exists(fname):
+            size = os.path.getsize(fname)
+
+            # A crash can leave a torn record at the end. Drop it so later records stay aligned.
+            if size % RECORD.size:
+                logger.warning(f"Dropping a partial record at the end of {fname}")
+                size -= size % RECORD.size
+                os.truncate(fname, size)
+
+            # Carry on the time order of the records already in the file
+            if size:
+                with open(fname, 'rb') as f:
+                    f.seek(size - RECORD.size)
+                    self.last_time = RECORD.unpack(f.read(RECORD.size))[0]
+
+        self.file = open(fname, 'ab', buffering=64 * 1024)
+
+    def record(self, event:str, value:float, t:float=None) -> None:
+        """Append an event
+
+        Args:
+            event (str): Event name, a key of EVENTS
+            value (float): Event value, see STATES for state events
+            t (float): Epoch time of the event, now if not given
+        """
+        t = time.time() if t is None else t
+        if t >= self._day_end:
+            self.open_day(t)
+
+        if t < self.last_time:
+            # The clock stepped back. Keep the file in time order for the binary search.
+            logger.warning(f"Clock went back {self.last_time - t:.3f} s, journaling {event} at the last recorded time")
+            t = self.last_time
+        self.last_time = t
+
+        self.file.write(RECORD.pack(t, EVENTS[event], self.source, value))
+        self.pending += 1
+        self.tick()
+
+    def record_state(self, event:str, state:str, t:float=None) -> None:
+        """Append a state event
+
+        Args:
+            event (str): Event name, a key of EVENTS
+            state (str): State name, a key of STATES
+            t (float): Epoch time of the event, now if not given
+        """
+        self.record(event, STATES.get(state, -1), t)
+
+    def tick(self) -> None:
+        """Commit pending records once the fsync interval has elapsed. Call from the run loop so
+        that records are committed on time even when no further events arrive.
+        """
+        if self.pending and time.monotonic() - self._last_commit >= self.fsync_interval:
+            self.commit()
+
+    def commit(self) -> None:
+        """Flush pending records and sync them to disk
+        """
+        if self.file is not None and self.pending:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.pending = 0
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        """Commit pending records and close the current file
+        """
+        if self.file is not None:
+            self.commit()
+            self.file.close()
+            self.file = None
+
+class journal_reader:
+    """Memory mapped view of one journal file. The writer keeps records in time order, so a time
+    range is found by binary search without reading the rest of the file.
+    """
+
+    def __init__(self, fname:str) -> None:
+        """Open a journal file
+
+        Args:
+            fname (str): Journal file path
+        """
+        self.fname = fname
+        self.map = None
+        self.n = 0
+
+        with open(fname, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= RECORD.size:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # Ignore a partial record still being written
+                self.n = size // RECORD.size
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, idx:int) -> tuple:
+        """Read one record
+
+        Returns:
+            tuple: (epoch time, event code, source code, value)
+        """
+        if not 0 <= idx < self.n:
+            raise IndexError(idx)
+
+        return RECORD.unpack_from(self.map, idx * RECORD.size)
+
+    def time_at(self, idx:int) -> float:
+        """Time of one record
+        """
+        return RECORD.unpack_from(self.map, idx * RECORD.size)[0]
+
+    def find(self, t:float) -> int:
+        """Index of the first record at or after a time
+
+        Args:
+            t (float): Epoch time
+
+        Returns:
+            int: Record index, len(self) if every record is earlier
+        """
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time_at(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def query(self, start:float=None, end:float=None, event:str=None):
+        """Read the records in a time range
+
+        Args:
+            start (float): Earliest epoch time, the start of the file if not given
+            end (float): Latest epoch time (exclusive), the end of the file if not given
+            event (str): Only return this event, a key of EVENTS
+
+        Yields:
+            tuple: (epoch time, event code, source code, value)
+        """
+        first = 0 if start is None else self.find(start)
+        last = self.n if end is None else self.find(end)
+        code = None if event is None else EVENTS[event]
+
+        for idx in range(first, last):
+            record = self[idx]
+            if code is None or record[1] == code:
+                yield record
+
+    def close(self) -> None:
+        """Unmap the file
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+def journal_files(directory:str=journal_dir, name:str=None) -> list:
+    """List journal files, oldest day first
+
+    Args:
+        directory (str): Journal directory
+        name (str): Only list the files of this daemon
+
+    Returns:
+        list: File paths
+    """
+    paths = glob.glob(os.path.join(directory, (name or "*") + "-*.jnl"))
+
+    # Order by the date in the file name, then by daemon
+    return sorted(paths, key=lambda p: (os.path.basename(p).split('-', 1)[1], p))
+
+def query_journal(directory:str=journal_dir, start:float=None, end:float=None, event:str=None, name:str=None):
+    """Read the records in a time range across every journal file, in time order within each daemon
+
+    Args:
+        directory (str): Journal directory
+        start (float): Earliest epoch time
+        end (float): Latest epoch time (exclusive)
+        event (str): Only return this event, a key of EVENTS
+        name (str): Only read the journal of this daemon
+
+    Yields:
+        tuple: (epoch time, event code, source code, value)
+    """
+    for fname in journal_files(directory, name):
+        reader = journal_reader(fname)
+        try:
+            yield from reader.query(start, end, event)
+        finally:
+            reader.close()
+
+def format_record(record:tuple) -> str:
+    """Render a record as a readable line
+    """
+    t, code, source, value = record
+    event = EVENT_NAMES.get(code, str(code))
+    shown = STATE_NAMES.get(int(value), value) if event != "sensor_error" else value
+
+    return f"{dt.fromtimestamp(t).isoformat(timespec='milliseconds')} {SOURCE_NAMES.get(source, source):12s} {event:12s} {shown}"
+
+def parse_time(value:str) -> float:
+    """argparse helper turning an ISO 8601 local time into an epoch time
+    """
+    return dt.fromisoformat(value).timestamp()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print WATCHES journal events")
+    parser.add_argument("--start", type=parse_time, help="Start of the time range, e.g. 2024-05-01T00:00")
+    parser.add_argument("--end", type=parse_time, help="End of the time range")
+    parser.add_argument("--event", choices=list(EVENTS), help="Only print this event")
+    parser.add_argument("--source", choices=list(SOURCES), help="Only read this daemon's journal")
+    parser.add_argument("--dir", default=journal_dir, help="Journal directory")
+    args = parser.parse_args()
+
+    for record in query_journal(args.dir, args.start, args.end, args.event, args.source):
+        print(format_record(record))
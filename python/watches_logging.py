@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import logging
+import logging.handlers
+import os
+from datetime import datetime as dt
+
+def setup_logging(prefix:str, parent_dir:str) -> str:
+    """Send the process's logging to a new rotating log file in the logs directory. Called from a
+    daemon's entry point, so importing a daemon module has no side effects.
+
+    Args:
+        prefix (str): Log file name prefix, e.g. "PLANTMANAGER"
+        parent_dir (str): Repository root holding the logs directory
+
+    Returns:
+        str: Path of the logs directory
+    """
+    now = dt.now()
+    log_dir = os.path.join(parent_dir, "logs")
+
+    # Make a logs directory if it does not exist
+    if not os.path.isdir(log_dir):
+        os.mkdir(log_dir)
+
+    logname = os.path.join(log_dir, prefix + "-" + now.strftime('%Y-%m-%dT%H-%M-%S') + ('-%02d' % (now.microsecond / 10000)) + ".log")
+
+    rfh = logging.handlers.RotatingFileHandler(filename=logname,
+        mode='a',
+        maxBytes=5*1024*1024,
+        backupCount=1,
+        encoding=None,
+        delay=0,
+    )
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S%p',
+                        level=logging.INFO,
+                        handlers=[rfh])
+
+    return log_dir
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime as dt
+
+logger = logging.getLogger('WATCHES-PROFILING')
+
+class sampling_profiler:
+    """Low overhead statistical profiler. A background thread samples the main thread's stack at a
+    fixed interval and counts identical stacks, written out in the folded format flame graph tools read.
+    """
+
+    def __init__(self, interval:float) -> None:
+        """Construct a sampling profiler
+
+        Args:
+            interval (float): Seconds between samples
+        """
+        self.interval = interval
+        self.counts = {}
+        self._thread_id = threading.main_thread().ident
+        self._running = False
+        self._thread = None
+
+    def start(self) -> None:
+        """Start sampling
+        """
+        self.counts = {}
+        self._running = True
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling
+        """
+        self._running = False
+        self._thread.join()
+
+    def _sample(self) -> None:
+        """Sampling thread body
+        """
+        while self._running:
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                frame = frame.f_back
+
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            time.sleep(self.interval)
+
+    def dump(self, fname:str) -> None:
+        """Write the sampled stacks in folded format, one "stack count" line each
+
+        Args:
+            fname (str): Output file path
+        """
+        with open(fname, 'w') as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+class profiling_hooks:
+    """On demand profiling for a running daemon, driven by signals so that it works under systemd:
+
+        SIGUSR1: start a profiling session, or stop it and dump the results into the logs directory
+        SIGUSR2: start tracemalloc, or take a snapshot of the top allocations
+        SIGRTMIN: take a final snapshot and stop tracemalloc
+
+    A session runs cProfile (or the sampling profiler) and wraps registered hot path methods with
+    timers. Nothing is wrapped or traced outside a session, so there is no overhead while idle.
+    """
+
+    def __init__(self, name:str, log_dir:str, config:dict) -> None:
+        """Construct profiling hooks for one daemon
+
+        Args:
+            name (str): Daemon name, used for the output file names
+            log_dir (str): Directory the results are written to
+            config (dict): WATCHES configuration
+        """
+        self.name = name
+        self.log_dir = log_dir
+        self.mode = config.get("profiler", "cprofile")
+        self.sample_interval = config.get("profile_sample_interval", 0.005)
+
+        self.targets = []
+        self.timers = {}
+        self.profiler = None
+        self.session_start = None
+        self.last_memory_snapshot = None
+
+    def register(self, obj, method_names:list) -> None:
+        """Register methods to be timed during a profiling session
+
+        Args:
+            obj (object): Object owning the methods
+            method_names (list): Names of the methods to time
+        """
+        self.targets.append((obj, method_names))
+
+    def install(self) -> None:
+        """Install the signal handlers. Must be called from the main thread.
+        """
+        signal.signal(signal.SIGUSR1, self.toggle_profiling)
+        signal.signal(signal.SIGUSR2, self.memory_snapshot)
+        signal.signal(signal.SIGRTMIN, self.stop_memory_tracing)
+        logger.info(f"Profiling hooks installed, send SIGUSR1/SIGUSR2/SIGRTMIN to pid {os.getpid()}")
+
+    def output_fname(self, kind:str, ext:str) -> str:
+        """Build a timestamped output path in the logs directory
+        """
+        now = dt.now().strftime('%Y-%m-%dT%H-%M-%S')
+        return os.path.join(self.log_dir, f"{kind}-{self.name}-{now}.{ext}")
+
+    def toggle_profiling(self, signum=None, frame=None) -> None:
+        """Signal handler starting or stopping a profiling session
+        """
+        if self.profiler is None:
+            self.start_profiling()
+        else:
+            self.stop_profiling()
+
+    def start_profiling(self) -> None:
+        """Start a profiling session
+        """
+        if self.mode == "sampling":
+            self.profiler = sampling_profiler(self.sample_interval)
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.timers = {}
+        for obj, method_names in self.targets:
+            for method_name in method_names:
+                setattr(obj, method_name, self.timed(getattr(obj, method_name), f"{type(obj).__name__}.{method_name}"))
+
+        self.session_start = time.monotonic()
+        logger.info(f"Started {self.mode} profiling")
+
+    def stop_profiling(self) -> None:
+        """Stop the profiling session and dump its results
+        """
+        if self.mode == "sampling":
+            self.profiler.stop()
+            self.profiler.dump(self.output_fname("PROFILE", "folded"))
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.output_fname("PROFILE", "prof"))
+
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats('cumulative').print_stats(40)
+            with open(self.output_fname("PROFILE", "txt"), 'w') as f:
+                f.write(text.getvalue())
+
+        # Remove the wrappers so the class methods are used again
+        for obj, method_names in self.targets:
+            for method_name in method_names:
+                obj.__dict__.pop(method_name, None)
+
+        self.dump_timers(time.monotonic() - self.session_start)
+        self.profiler = None
+        logger.info("Stopped profiling, results written to logs")
+
+    def timed(self, method, label:str):
+        """Wrap a bound method so each call accumulates into the session's timers
+
+        Args:
+            method (callable): Bound method to wrap
+            label (str): Timer name
+
+        Returns:
+            callable: The wrapper
+        """
+        timer = self.timers.setdefault(label, dict(calls=0, total=0.0, max=0.0))
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                timer["calls"] += 1
+                timer["total"] += elapsed
+                timer["max"] = max(timer["max"], elapsed)
+
+        return wrapper
+
+    def dump_timers(self, duration:float) -> None:
+        """Write the hot path timers of the session
+
+        Args:
+            duration (float): Session length in seconds
+        """
+        with open(self.output_fname("TIMERS", "txt"), 'w') as f:
+            f.write(f"Session length {duration:.1f} s\n")
+            f.write(f"{'function':40s} {'calls':>8s} {'total ms':>10s} {'mean ms':>10s} {'max ms':>10s} {'% time':>7s}\n")
+
+            for label, timer in sorted(self.timers.items(), key=lambda item: -item[1]["total"]):
+                mean = timer["total"] / timer["calls"] if timer["calls"] else 0.0
+                f.write(f"{label:40s} {timer['calls']:8d} {timer['total']*1e3:10.2f} {mean*1e3:10.3f} "
+                        f"{timer['max']*1e3:10.3f} {100*timer['total']/max(duration, 1e-9):7.2f}\n")
+
+    def memory_snapshot(self, signum=None, frame=None) -> None:
+        """Signal handler starting tracemalloc, or writing the top allocations once it is running
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            logger.info("Started tracemalloc, signal again to take a snapshot")
+            return
+
+        self.write_memory_snapshot()
+
+    def stop_memory_tracing(self, signum=None, frame=None) -> None:
+        """Signal handler writing a final snapshot and stopping tracemalloc, which otherwise keeps
+        costing memory and time on every allocation for the life of the process
+        """
+        if not tracemalloc.is_tracing():
+            logger.info("tracemalloc is not running")
+            return
+
+        self.write_memory_snapshot()
+        tracemalloc.stop()
+        self.last_memory_snapshot = None
+        logger.info("Stopped tracemalloc")
+
+    def write_memory_snapshot(self) -> None:
+        """Write the top allocations, and their growth since the previous snapshot, to the logs directory
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+
+        with open(self.output_fname("MEMORY", "txt"), 'w') as f:
+            f.write(f"Traced memory: current {current/1024:.1f} KiB, peak {peak/1024:.1f} KiB\n\nTop allocations:\n")
+            for stat in snapshot.statistics('lineno')[:30]:
+                f.write(f"{stat}\n")
+
+            # Growth since the previous snapshot is what points at a leak
+            if self.last_memory_snapshot is not None:
+                f.write("\nGrowth since last snapshot:\n")
+                for stat in snapshot.compare_to(self.last_memory_snapshot, 'lineno')[:30]:
+                    f.write(f"{stat}\n")
+
+        self.last_memory_snapshot = snapshot
+        logger.info("Wrote tracemalloc snapshot to logs")
@@ -4,43 +4,23 @@ import zmq
 import time
 from datetime import datetime as dt
 import numpy as np
-import math
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import json
 import logging
-import logging.handlers
 import os, sys
-import signal
+
+from watches_analytics import stream_analytics
+from watches_control import predictive_control
+from watches_journal import journal_writer
+from watches_logging import setup_logging
+from watches_profiling import profiling_hooks
+from watches_snapshot import state_snapshot
+from watches_sockets import apply_socket_policy, message_drain, sequenced_socket, zoned_topics
+from watches_storage import compact_temp_log
 
 # TODO: Add proper state setting
 
-# Set up the logger
-now = dt.now()
+# Logging is configured in __main__, so importing this module has no side effects
 parent_dir = os.path.split(os.getcwd())[0]
-log_dir = os.path.join(parent_dir, "logs")
-
-# Make a logs directory if it does not exist
-if not os.path.isdir(log_dir):
-    os.mkdir(log_dir)
-
-# Set up the logger
-logname = os.path.join(log_dir, "PLANTMANAGER-" + now.strftime('%Y-%m-%dT%H-%M-%S') + ('-%02d' % (now.microsecond / 10000)) + ".log")
-
-rfh = logging.handlers.RotatingFileHandler(filename=logname, 
-    mode='a',
-    maxBytes=5*1024*1024,
-    backupCount=1,
-    encoding=None,
-    delay=0,
-)
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-                    datefmt='%m/%d/%Y %I:%M:%S%p', 
-                    level=logging.INFO,
-                    handlers=[rfh])
 
 logger = logging.getLogger('WATCHES-PLANT-MANAGER')
 
@@ -58,39 +38,81 @@ class plant_manager:
         self.loop_ctr = 0
         self._verbose = verbose
         
-        # Create a dict to contain our topics list and states
-        self.topics = dict(fancontrol='fancontrol', fanstate='fanstate', temp='temp')
-        self.requests = dict(getstate="getstate", turnon="turnon", turnoff = "turnoff")
+        # Create a dict to contain our topics list and states. Topics carry our zone prefix, if any.
+        self.topics = zoned_topics(self.config, fancontrol='fancontrol', fanstate='fanstate', temp='temp', alert='alert')
+        self.requests = dict(getstate="getstate", turnon="turnon", turnoff = "turnoff", set="set")
         self.states = dict(on="on", off="off", error="error", warning="warning")
         self.state = self.states.get("off")
         
         # Determine log size
         log_array_size = 60 * 60 * 24 # We always want our plot to be at 1 second resolution
         
-        # Allocate temperature log
-        self.temp_log = np.empty(log_array_size)
-        self.temp_log[:] = np.nan
+        # Storage mode: "float64" arrays, or "compact" int16 centi-degrees with an implicit time axis
+        self.storage_mode = self.config.get("storage_mode", "float64")
         
-        # Our time axis will be on the 24hr clock seconds index
-        self.time_axis = np.arange(log_array_size)
+        if self.storage_mode == "compact":
+            # Allocate temperature log
+            self.temp_log = compact_temp_log(log_array_size)
+            
+            # Our time axis will be on the 24hr clock seconds index, derived rather than stored
+            self.time_axis = range(log_array_size)
+        else:
+            # Allocate temperature log
+            self.temp_log = np.empty(log_array_size)
+            self.temp_log[:] = np.nan
+            
+            # Our time axis will be on the 24hr clock seconds index
+            self.time_axis = np.arange(log_array_size)
         self.xlim_min = 0
         self.xlim_max = log_array_size # we can do this since it is equal to the time in seconds we are logging
         
+        # Display mode: "tk" draws a local matplotlib window, "web" serves a dashboard to browsers
+        self.display_mode = self.config.get("display_mode", "tk")
+        self.dashboard = None
+        self.figure = None
+        self.current_reading = None
+        
+        # Durable binary journal of control events
+        self.journal = journal_writer(self.config, "PLANTMANAGER")
+        
+        # Streaming statistics and fault detection on the temperature stream
+        self.analytics = stream_analytics(self.config)
+        
+        # Control mode: "hysteresis" switches on threshold crossings, "predictive" switches ahead of them
+        self.control_mode = self.config.get("control_mode", "hysteresis")
+        self.controller = predictive_control(self.config) if self.control_mode == "predictive" else None
+        
         # Create a ZMQ publisher to talk to other hardware systems
         self._ctx = zmq.Context()
-        self.publisher = self._ctx.socket(zmq.PUB)
-        self.publisher.bind(str(self.config.get("server_pub_socket")))
+        self.publisher = sequenced_socket(self._ctx.socket(zmq.PUB), "plant_manager")
         
         # Create a ZMQ subscriber to listen to other hardware systems
         self.subscriber = self._ctx.socket(zmq.SUB)
-        self.subscriber.bind(str(self.config.get("server_sub_socket")))
+        
+        # Bound queues before connecting. Per topic queueing and conflation happen in message_drain.
+        apply_socket_policy(self.publisher, self.config)
+        apply_socket_policy(self.subscriber, self.config)
+        
+        if self.config.get("use_broker"):
+            # The broker owns both endpoints: publish into its frontend, subscribe to its backend
+            self.publisher.connect(str(self.config.get("server_sub_socket")))
+            self.subscriber.connect(str(self.config.get("server_pub_socket")))
+        else:
+            self.publisher.bind(str(self.config.get("server_pub_socket")))
+            self.subscriber.bind(str(self.config.get("server_sub_socket")))
+            
         self.subscriber.subscribe(self.topics.get("temp")) 
         self.subscriber.subscribe(self.topics.get("fanstate"))
+        self.drain = message_drain(self.subscriber, self.config, "Plant manager")
 
         # Flag to let us know if we are waiting on a request
         self.waiting_for_fan_state = False
         self.commanded_fan_state = self.states.get("off")
         self.reported_fan_state =  self.states.get("off")
+        
+        # Resume the control state and today's temperature log from before a restart
+        self.snapshot = state_snapshot(self.config, "plant_manager")
+        self.restore_snapshot()
             
         # Create a log
         logger.info("Server initialzed")
@@ -131,7 +153,7 @@ class plant_manager:
     
     def relay_control_fsm(self, temp_reading:float, relay_state:bool) -> str:
         """This is the logic that controls the fan. It is a simple threshold with 
-        hysteresis state control implementation. 
+        hysteresis state control implementation, or the predictive controller when configured.
 
         Args:
             temp_reading (float): Temperature reading sent from the temperature sensor driver process
@@ -140,6 +162,9 @@ class plant_manager:
         Returns:
             int: Status
         """
+        if self.controller is not None:
+            return self.predictive_control_fsm(temp_reading, relay_state)
+        
         status = 1
         
         # If the fan is on, it needs to drop below set point - hysteresis to turn off
@@ -173,10 +198,50 @@ class plant_manager:
             # Error state
             logger.warning('Unrecognized Inputs. Issuing error.')
             status = -100
-            self.state = self.states.get("error")
+            self.set_state(self.states.get("error"))
             
         return status
     
+    def predictive_control_fsm(self, temp_reading:float, relay_state:bool) -> int:
+        """Fan control from the predictive controller: switch when the projected temperature
+        crosses a threshold within the lead time, holding each state for its minimum time.
+
+        Args:
+            temp_reading (float): Temperature reading sent from the temperature sensor driver process
+            relay_state (bool): Current state of the fan relay, as inferred from the relay driver process
+
+        Returns:
+            int: Status
+        """
+        status = 1
+        
+        if relay_state not in (self.states.get("on"), self.states.get("off")):
+            # Error state
+            logger.warning('Unrecognized Inputs. Issuing error.')
+            self.set_state(self.states.get("error"))
+            return -100
+        
+        fan_on = relay_state == self.states.get("on")
+        want_on = self.controller.update(time.monotonic(), temp_reading, fan_on)
+        
+        # Command again until the relay reports the decided state
+        if want_on and not fan_on:
+            status = self.set_fan_on()
+        elif fan_on and not want_on:
+            status = self.set_fan_off()
+            
+        return status
+    
+    def set_state(self, state:str) -> None:
+        """ Change the plant manager state, journaling the change
+
+        Args:
+            state (str): New state
+        """
+        if state != self.state:
+            self.journal.record_state("fsm_state", state)
+        self.state = state
+        
     def update_temp_log(self, value:float, timestamp:str) -> None:
         """ Maintain a time aligned vector of temperature readings from the temperature sensor
 
@@ -194,11 +259,33 @@ class plant_manager:
         
         # Update our plot (magic)
         if self._verbose:
-            self.plot_update(seconds_idx, value)
+            if self.dashboard is not None:
+                self.dashboard.publish("reading", dict(t=seconds_idx, v=value))
+            else:
+                self.plot_update(seconds_idx, value)
+        self.current_reading = dict(t=seconds_idx, v=value)
 
         # Log it
         logger.info(f"Got reading {value} degF at time {seconds_idx} seconds")
                 
+    def update_analytics(self, temp_reading:float) -> None:
+        """ Feed a temperature reading through the analytics stage and publish any alert changes
+
+        Args:
+            temp_reading (float): Input temperature reading
+        """
+        fan_on = self.reported_fan_state == self.states.get("on")
+        
+        for name, raised, value in self.analytics.update(time.monotonic(), temp_reading, fan_on):
+            status = "raised" if raised else "cleared"
+            msg = self.add_topic(self.topics.get('alert'), f"{name}:{status}:{value}")
+            self.publisher.send_string(msg)
+            
+            if raised:
+                logger.warning(f"Alert {name} raised ({value})")
+            else:
+                logger.info(f"Alert {name} cleared ({value})")
+                
     def celsius_to_fahrenheit(self, input_temp_c:float) -> float:
         """ A function to take a temperature in celsius, and convert it to 
         fahrenheit.
@@ -221,19 +308,23 @@ class plant_manager:
 
         # Initialize a plot to view our data
         if self._verbose:
-            self.plot_setup()
+            if self.display_mode == "web":
+                self.dashboard_setup()
+            else:
+                self.plot_setup()
 
         while True:
-            # Receive messages over the ZMQ link
-            try:
-                message = self.subscriber.recv_string(flags=zmq.NOBLOCK)
-                
+            # Receive everything waiting on the ZMQ link, so a stall never leaves a backlog of stale readings
+            for message in self.drain.poll():
                 # Parse the received message
                 self.parse_message(message)
             
-            except zmq.Again as e:
-                # If no message rx'd, do nothing
-                pass                
+            # Checkpoint the control state for a warm restart
+            if self.snapshot.due():
+                self.save_snapshot()
+                
+            # Commit journaled events once per fsync interval
+            self.journal.tick()
             
             # Every so often, ask the fan what state it is in so we can maintain an up to date state
             self.loop_ctr+=1
@@ -247,9 +338,54 @@ class plant_manager:
             # Run the main loop faster than the hardware drivers (these are not strictly timed loops)
             time.sleep(self.config.get("server_update_rate"))
             
+    def save_snapshot(self, include_log:bool=True) -> None:
+        """ Checkpoint the control state and temperature log
+
+        Args:
+            include_log (bool): Also save the temperature log, which is only needed periodically
+        """
+        self.snapshot.save(dict(commanded_fan_state=self.commanded_fan_state,
+                                reported_fan_state=self.reported_fan_state,
+                                state=self.state,
+                                date=dt.now().strftime('%Y-%m-%d'),
+                                storage_mode=self.storage_mode,
+                                controller=self.controller.save() if self.controller is not None else None))
+        
+        # Save the log as stored, so compact mode snapshots stay compact
+        if include_log:
+            self.snapshot.save_array("temp_log", getattr(self.temp_log, "raw", self.temp_log))
+        
+    def restore_snapshot(self) -> None:
+        """ Resume from the last checkpoint, if it is fresh, so the FSM doesn't have to re-sync
+        """
+        saved = self.snapshot.load()
+        if saved is None:
+            logger.info("No fresh snapshot, starting cold")
+            return
+        
+        self.commanded_fan_state = saved.get("commanded_fan_state", self.commanded_fan_state)
+        self.reported_fan_state = saved.get("reported_fan_state", self.reported_fan_state)
+        self.state = saved.get("state", self.state)
+        if self.controller is not None and saved.get("controller"):
+            self.controller.restore(saved["controller"])
+        
+        # The log is indexed by time of day, so only yesterday's readings would be misplaced
+        if saved.get("date") == dt.now().strftime('%Y-%m-%d') and saved.get("storage_mode", "float64") == self.storage_mode:
+            temp_log = self.snapshot.load_array("temp_log")
+            raw_log = getattr(self.temp_log, "raw", self.temp_log)
+            if temp_log is not None and temp_log.shape == raw_log.shape:
+                raw_log[:] = temp_log
+                
+        logger.info(f"Resumed from snapshot: commanded {self.commanded_fan_state}, reported {self.reported_fan_state}")
+            
     def plot_setup(self) -> None:
         """ Initialie a matplotlib window to plot the temperature log
         """       
+        # matplotlib and Tk are only loaded when a local window is wanted
+        import matplotlib
+        matplotlib.use('TkAgg')
+        import matplotlib.pyplot as plt
+        
         # Set interactive on and create axes objects
         plt.ion() 
         self.figure, self.ax = plt.subplots()
@@ -257,18 +393,19 @@ class plant_manager:
         self.figure.set_figwidth(10)
         
         # Plot the last 24 hours of readings
-        self.line, = self.ax.plot(self.time_axis, self.temp_log, 'b', label="Historic readings")
+        self.line, = self.ax.plot(*self.plot_data(), 'b', label="Historic readings")
         
         # Plot the current reading
         self.stem = self.ax.stem([0],[0],'r',  markerfmt ='D', label="Current reading")
         
-        # Plot the set points
-        setpoint_line = self.config.get("set_point") * np.ones(60*60*24)
-        hysteresis_line = (self.config.get("set_point") - self.config.get("hysteresis")) * np.ones(60*60*24)
+        # Plot the set points. They are constant, so a two point segment across the day is enough
+        line_ends = [self.time_axis[0], self.time_axis[-1]]
+        setpoint_line = [self.config.get("set_point")] * 2
+        hysteresis_line = [self.config.get("set_point") - self.config.get("hysteresis")] * 2
         
         # Don't expect to update these in realtime
-        self.ax.plot(self.time_axis, setpoint_line, '#008000', label="Upper range")        
-        self.ax.plot(self.time_axis, hysteresis_line, 'k', label="Lower range")
+        self.ax.plot(line_ends, setpoint_line, '#008000', label="Upper range")        
+        self.ax.plot(line_ends, hysteresis_line, 'k', label="Lower range")
 
         # Set ax limits
         self.ax.set_xlim(left=0, right=len(self.time_axis))
@@ -303,6 +440,59 @@ class plant_manager:
         self.ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.15),
                 fancybox=True, shadow=True, ncol=5)
         
+    def plot_data(self) -> tuple:
+        """ Data for the temperature log trace. A compact log is drawn from a downsampled float view,
+        matplotlib would otherwise keep float64 copies of the whole log and time axis.
+
+        Returns:
+            tuple: (time axis, temperature log)
+        """
+        if self.storage_mode != "compact":
+            return self.time_axis, self.temp_log
+        
+        from watches_dashboard import bin_size, downsample
+        
+        bins = self.config.get("plot_points", 1440)
+        size = bin_size(len(self.temp_log), bins)
+        values = np.array(downsample(self.temp_log, bins), dtype=float)
+        
+        return np.arange(len(values)) * size, values
+        
+    def dashboard_setup(self) -> None:
+        """ Start the headless web dashboard in place of the matplotlib window
+        """
+        from watches_dashboard import watches_dashboard
+        
+        self.dashboard = watches_dashboard(self.config.get("dashboard_host", "0.0.0.0"),
+                                           self.config.get("dashboard_port", 8080),
+                                           self.dashboard_snapshot)
+        self.dashboard.start()
+        
+    def dashboard_snapshot(self) -> dict:
+        """ Build the initial view sent to a dashboard viewer when it connects
+
+        Returns:
+            dict: Downsampled temperature log, set points and current fan state
+        """
+        from watches_dashboard import bin_size, downsample
+        
+        bins = self.config.get("dashboard_snapshot_points", 1440)
+        
+        return dict(values=downsample(self.temp_log, bins),
+                    bin_seconds=bin_size(len(self.temp_log), bins),
+                    set_point=self.config.get("set_point"),
+                    hysteresis=self.config.get("hysteresis"),
+                    lower=self.config.get("graph_lower_extent"),
+                    upper=self.config.get("graph_upper_extent"),
+                    current=self.current_reading,
+                    fan=dict(commanded=self.commanded_fan_state, reported=self.reported_fan_state))
+        
+    def dashboard_publish_fan(self) -> None:
+        """ Push the commanded and reported fan state to dashboard viewers, if any
+        """
+        if self.dashboard is not None:
+            self.dashboard.publish("fan", dict(commanded=self.commanded_fan_state, reported=self.reported_fan_state))
+        
     def plot_update(self, current_time_idx:int, current_temp_reading:float) -> None:
         """Update the temperature log plot with the current reading
 
@@ -312,7 +502,7 @@ class plant_manager:
         """
 
         # Update the trace with new data        
-        self.line.set_ydata(self.temp_log)
+        self.line.set_ydata(self.plot_data()[1])
         
         # Highlight the current reading
         self.stem[0].set_ydata([current_temp_reading])
@@ -333,12 +523,19 @@ class plant_manager:
             msg = self.add_topic(self.topics.get('fancontrol'), self.requests.get("turnon"))
             self.publisher.send_string(msg)
             logger.info("Set Fan ON")
+            changed = self.commanded_fan_state != self.states.get("on")
             self.commanded_fan_state = self.states.get("on")
+            self.journal.record_state("fan_command", self.commanded_fan_state)
+            self.dashboard_publish_fan()
+            
+            # Checkpoint a new command straight away, a crash before the next periodic save must not undo it
+            if changed:
+                self.save_snapshot(include_log=False)
         except:
             logger.warning("Unable to set fan to on")
             status = -100
     
-            return status
+        return status
         
     def set_fan_off(self) -> int:
         """ Request set fan control relay off
@@ -352,13 +549,42 @@ class plant_manager:
             msg = self.add_topic(self.topics.get('fancontrol'), self.requests.get("turnoff"))
             self.publisher.send_string(msg)
             logger.info("Set Fan OFF")
+            changed = self.commanded_fan_state != self.states.get("off")
             self.commanded_fan_state = self.states.get("off")
+            self.journal.record_state("fan_command", self.commanded_fan_state)
+            self.dashboard_publish_fan()
+            
+            # Checkpoint a new command straight away, a crash before the next periodic save must not undo it
+            if changed:
+                self.save_snapshot(include_log=False)
         except:
             logger.warning("Unable to set fan to off")
             status = -100
             
         return status
     
+    def set_relay_channels(self, channels:dict) -> int:
+        """ Request individual relay channels on or off, applied by the fan controller in one batch
+
+        Args:
+            channels (dict): Relay channel name to requested state ("on" or "off")
+
+        Returns:
+            int: Status
+        """
+        status = 1
+        
+        try:
+            args = ','.join(f"{name}={state}" for name, state in channels.items())
+            msg = self.add_topic(self.topics.get('fancontrol'), f"{self.requests.get('set')}:{args}")
+            self.publisher.send_string(msg)
+            logger.info(f"Set relays {args}")
+        except:
+            logger.warning("Unable to set relay channels")
+            status = -100
+            
+        return status
+    
     def get_fan_state(self) -> int:
         """Request get the status of the fan relay
 
@@ -399,11 +625,14 @@ class plant_manager:
             
             # Rx'd fan state data
             fan_state = messagedata
+            # Every poll reply carries the state, only journal a change
+            if fan_state != self.reported_fan_state:
+                self.journal.record_state("fan_state", fan_state)
             self.reported_fan_state = fan_state
             self.waiting_for_fan_state = False
             
             if self.commanded_fan_state != self.reported_fan_state:
-                self.state = self.states.get("warning")
+                self.set_state(self.states.get("warning"))
                 logger.warning("Fan reported state inconsistent with commanded state")
                 
                 # If this occurs, request again
@@ -415,9 +644,10 @@ class plant_manager:
                     logger.warning('Unknown fan state')
 
             elif self.commanded_fan_state == self.reported_fan_state:
-                self.state = self.states.get("on")
+                self.set_state(self.states.get("on"))
             
-            logger.info(f"Got fan state {fan_state} from FANCONTROL")                               
+            logger.info(f"Got fan state {fan_state} from FANCONTROL")
+            self.dashboard_publish_fan()                               
             
         elif topic == self.topics.get('temp'):
             # Update our temperature log
@@ -430,6 +660,9 @@ class plant_manager:
             # Update temp log
             self.update_temp_log(temp_reading_f, timestamp)
             
+            # Update rolling statistics and raise any alerts
+            self.update_analytics(temp_reading_f)
+            
             # Execute our fan control state machine
             self.relay_control_fsm(temp_reading_f, fan_state)
             
@@ -443,19 +676,33 @@ class plant_manager:
         """Gracefully shutdown zmq ports and exit the program
         """
         logger.info("Gracefully exiting")
+        self.save_snapshot()
+        self.journal.close()
         self.publisher.close()
         self.subscriber.close()
         self._ctx.term()
-        plt.close('all')
+        if self.dashboard is not None:
+            self.dashboard.stop()
+        elif self.figure is not None:
+            import matplotlib.pyplot as plt
+            plt.close('all')
         print("\nshutdown")
         sys.exit(0)
 
 if __name__ == "__main__":
+    # Log to a new file in the logs directory
+    log_dir = setup_logging("PLANTMANAGER", parent_dir)
+
     config_path = os.path.join(parent_dir, "cfg","watches_cfg.json")
 
     # Create WATCHES server objectour
     manager = plant_manager(config_path, verbose=True)
 
+    # On demand profiling, triggered with SIGUSR1/SIGUSR2
+    profiler = profiling_hooks("PLANTMANAGER", log_dir, manager.config)
+    profiler.register(manager, ["parse_message", "update_temp_log", "update_analytics", "relay_control_fsm", "plot_update", "get_fan_state", "save_snapshot"])
+    profiler.install()
+
     # Handle exits
     try:
         manager.run()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger('WATCHES-SNAPSHOT')
+
+class state_snapshot:
+    """Checkpoint of a daemon's control state, so that a restart can resume where it left off
+    instead of cold starting. Snapshots are replaced atomically, so a crash mid-write leaves the
+    previous one intact. By default they live in /dev/shm: they survive service restarts without
+    wearing the SD card, and a reboot (when the relay state is lost anyway) clears them.
+    """
+
+    def __init__(self, config:dict, name:str) -> None:
+        """Construct a snapshot for one daemon
+
+        Args:
+            config (dict): WATCHES configuration
+            name (str): Daemon name, used for the snapshot file names
+        """
+        self.dir = config.get("snapshot_dir", "/dev/shm/watches")
+        self.interval = config.get("snapshot_interval", 30)
+        self.max_age = config.get("snapshot_max_age", 600)
+        self.name = name
+        self.fname = os.path.join(self.dir, name + ".json")
+        self._last_save = time.monotonic()
+
+        os.makedirs(self.dir, exist_ok=True)
+
+    def load(self) -> dict:
+        """Read the snapshot, if there is a fresh one
+
+        Returns:
+            dict: Saved state, or None if there is no snapshot or it is older than the max age
+        """
+        try:
+            with open(self.fname) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        age = time.time() - snapshot.get("time", 0)
+        if age > self.max_age:
+            logger.info(f"Ignoring {self.name} snapshot, {age:.0f} seconds old")
+            return None
+
+        return snapshot.get("state")
+
+    def save(self, state:dict) -> None:
+        """Atomically replace the snapshot
+
+        Args:
+            state (dict): JSON serializable state
+        """
+        tmp_fname = self.fname + ".tmp"
+        with open(tmp_fname, 'w') as f:
+            json.dump(dict(time=time.time(), state=state), f)
+        os.replace(tmp_fname, self.fname)
+
+        self._last_save = time.monotonic()
+
+    def due(self) -> bool:
+        """Whether the periodic save interval has elapsed
+        """
+        return time.monotonic() - self._last_save >= self.interval
+
+    def array_fname(self, key:str) -> str:
+        """Path of an array saved next to the snapshot
+        """
+        return os.path.join(self.dir, f"{self.name}-{key}.npy")
+
+    def save_array(self, key:str, array) -> None:
+        """Atomically save a numpy array next to the snapshot
+
+        Args:
+            key (str): Array name
+            array (np.ndarray): Array to save
+        """
+        import numpy as np
+
+        tmp_fname = self.array_fname(key) + ".tmp"
+        with open(tmp_fname, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_fname, self.array_fname(key))
+
+    def load_array(self, key:str):
+        """Load an array saved next to the snapshot
+
+        Args:
+            key (str): Array name
+
+        Returns:
+            np.ndarray: The array, or None if it cannot be read
+        """
+        import numpy as np
+
+        try:
+            return np.load(self.array_fname(key))
+        except (OSError, ValueError):
+            return None
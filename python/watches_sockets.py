@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import time
+from collections import deque
+from socket import gethostname
+
+import zmq
+
+logger = logging.getLogger('WATCHES-SOCKETS')
+
+# Sequence numbers ride at the end of a message as ::#<publisher>:<seq>, counted per topic
+SEQUENCE_SEPARATOR = '::#'
+
+# Topics of a node in a zone carry the zone as a prefix, e.g. garage/temp
+ZONE_SEPARATOR = '/'
+
+def zoned_topics(config:dict, **topics) -> dict:
+    """Prefix a daemon's topics with its configured zone, if it has one
+
+    Args:
+        config (dict): WATCHES configuration
+        topics: Topic names, keyed by how the daemon refers to them
+
+    Returns:
+        dict: The same keys, mapped to the topics used on the wire
+    """
+    zone = config.get("zone")
+    if not zone:
+        return topics
+
+    return {key: f"{zone}{ZONE_SEPARATOR}{topic}" for key, topic in topics.items()}
+
+def base_topic(topic:str) -> str:
+    """Topic name without its zone prefix, as used to look up socket policies
+    """
+    return topic.rpartition(ZONE_SEPARATOR)[2]
+
+def apply_socket_policy(socket:zmq.Socket, config:dict) -> None:
+    """Set queueing options on a socket from the config. Must be called before bind/connect.
+
+    Socket level conflation (ZMQ_CONFLATE) is never used. It keeps one message for the whole
+    socket whatever its topic, and a conflating socket also keeps only the last subscription
+    message it receives, which silently stops a publisher behind the broker. Latest-value topics
+    are conflated per topic by message_drain instead.
+
+    Args:
+        socket (zmq.Socket): Socket to configure
+        config (dict): WATCHES configuration
+    """
+    hwm = config.get("socket_hwm", 1000)
+
+    socket.setsockopt(zmq.SNDHWM, hwm)
+    socket.setsockopt(zmq.RCVHWM, hwm)
+
+class sequenced_socket:
+    """A publishing socket that stamps every message with the publisher's identity and a sequence
+    number, so receivers can detect lost messages. Each topic is numbered separately, since a
+    subscriber only sees the topics it subscribed to. Everything else is passed through to the socket.
+    """
+
+    def __init__(self, socket:zmq.Socket, name:str) -> None:
+        """Wrap a socket
+
+        Args:
+            socket (zmq.Socket): Socket to publish on
+            name (str): Daemon name, made unique per host and per process start
+        """
+        self.socket = socket
+        self.publisher_id = f"{name}@{gethostname()}/{os.getpid()}-{int(time.time())}"
+        self.seq = {}
+
+    def send_string(self, msg:str, *args, **kwargs) -> None:
+        """Send a message with the next sequence number of its topic appended
+        """
+        topic = msg.split('::', 1)[0]
+        seq = self.seq[topic] = self.seq.get(topic, 0) + 1
+        self.socket.send_string(f"{msg}{SEQUENCE_SEPARATOR}{self.publisher_id}:{seq}", *args, **kwargs)
+
+    def __getattr__(self, name:str):
+        return getattr(self.socket, name)
+
+class sequence_tracker:
+    """Follow the sequence numbers of every publisher and topic seen on a socket, counting gaps
+    (lost messages), duplicates (replays, e.g. from the last-value cache) and publisher restarts
+    """
+
+    def __init__(self) -> None:
+        """Construct an empty tracker
+        """
+        self.sessions = {}
+        self.last_seq = {}
+        self.gaps = {}
+        self.duplicates = {}
+        self.restarts = {}
+
+    def check(self, publisher_id:str, topic:str, seq:int) -> bool:
+        """Record a received sequence number
+
+        Args:
+            publisher_id (str): Publisher identity, <name>@<host>/<process session>
+            topic (str): Topic of the message
+            seq (int): Sequence number within the topic
+
+        Returns:
+            bool: False if the message was already seen and should be skipped
+        """
+        name, _, session = publisher_id.rpartition('/')
+
+        if self.sessions.get(name) != session:
+            # First message from this publisher, or it restarted and began counting again
+            if name in self.sessions:
+                self.restarts[name] = self.restarts.get(name, 0) + 1
+                self.last_seq = {key: last for key, last in self.last_seq.items() if key[0] != name}
+            self.sessions[name] = session
+
+        key = (name, topic)
+        label = f"{name} {topic}"
+        last = self.last_seq.get(key)
+        self.last_seq[key] = max(seq, last or 0)
+
+        if last is None:
+            return True
+
+        if seq <= last:
+            self.duplicates[label] = self.duplicates.get(label, 0) + 1
+            return False
+
+        if seq > last + 1:
+            self.gaps[label] = self.gaps.get(label, 0) + seq - last - 1
+
+        return True
+
+class message_drain:
+    """Drain everything waiting on a socket each loop, applying per topic policies. Latest-value
+    topics are conflated so only the newest message survives. Other topics keep a bounded queue
+    that drops the oldest message on overflow. Every dropped message is counted.
+    """
+
+    def __init__(self, socket:zmq.Socket, config:dict, name:str) -> None:
+        """Construct a message drain
+
+        Args:
+            socket (zmq.Socket): Socket to receive from
+            config (dict): WATCHES configuration
+            name (str): Name used when reporting drops
+        """
+        self.socket = socket
+        self.name = name
+        self.policies = config.get("socket_policies", {})
+        self.default_queue = config.get("socket_queue", 100)
+        self.max_batch = config.get("socket_max_batch", 1000)
+        self.report_interval = config.get("drop_report_interval", 60)
+
+        self.drops = {}
+        self.sequences = sequence_tracker()
+        self._reported = {}
+        self._last_report = time.monotonic()
+
+    def poll(self) -> list:
+        """Receive every pending message without blocking
+
+        Returns:
+            list: Surviving messages, in arrival order
+        """
+        entries = []
+        latest = {}
+        queued = {}
+
+        for _ in range(self.max_batch):
+            try:
+                msg = self.socket.recv_string(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            topic = msg.split('::', 1)[0]
+
+            # Strip and check the sequence number, skipping messages that were already seen
+            if SEQUENCE_SEPARATOR in msg:
+                msg, sequence = msg.rsplit(SEQUENCE_SEPARATOR, 1)
+                publisher_id, _, seq = sequence.rpartition(':')
+                if not self.sequences.check(publisher_id, topic, int(seq)):
+                    continue
+
+            policy = self.policies.get(base_topic(topic), {})
+
+            if policy.get("conflate"):
+                # Supersede the older message of this topic
+                if topic in latest:
+                    entries[latest[topic]] = None
+                    self.count_drop(topic)
+                latest[topic] = len(entries)
+            else:
+                indices = queued.setdefault(topic, deque())
+                indices.append(len(entries))
+                if len(indices) > policy.get("queue", self.default_queue):
+                    entries[indices.popleft()] = None
+                    self.count_drop(topic)
+
+            entries.append(msg)
+
+        self.report()
+
+        return [msg for msg in entries if msg is not None]
+
+    def count_drop(self, topic:str) -> None:
+        """Record a dropped message
+
+        Args:
+            topic (str): Topic of the dropped message
+        """
+        self.drops[topic] = self.drops.get(topic, 0) + 1
+
+    def report(self) -> None:
+        """Log drops and sequence gaps accumulated since the last report, at most once per report interval
+        """
+        if time.monotonic() - self._last_report < self.report_interval:
+            return
+        self._last_report = time.monotonic()
+
+        counters = dict(drops=self.drops, gaps=self.sequences.gaps,
+                        duplicates=self.sequences.duplicates, restarts=self.sequences.restarts)
+
+        for kind, totals in counters.items():
+            reported = self._reported.get(kind, {})
+            new_counts = {key: count - reported.get(key, 0) for key, count in totals.items()}
+            new_counts = {key: count for key, count in new_counts.items() if count}
+            if new_counts:
+                logger.warning(f"{self.name} {kind}: {new_counts} (totals {totals})")
+            self._reported[kind] = dict(totals)
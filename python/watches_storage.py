@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class compact_temp_log:
+    """Temperature log stored as int16 hundredths of a degree, a quarter of the memory of float64.
+    Reads and writes look like a float array: missing readings read back as NaN, and numpy or
+    matplotlib consumers get a float64 array through __array__.
+    """
+
+    SCALE = 100
+    MISSING = np.iinfo(np.int16).min
+    LIMIT = np.iinfo(np.int16).max
+
+    def __init__(self, size:int) -> None:
+        """Construct an empty log
+
+        Args:
+            size (int): Number of samples
+        """
+        self.raw = np.full(size, self.MISSING, dtype=np.int16)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    @property
+    def shape(self) -> tuple:
+        return self.raw.shape
+
+    def encode(self, value) -> np.ndarray:
+        """Convert temperatures to stored values. NaN becomes the missing sentinel and readings
+        outside +/-327.67 degrees saturate.
+
+        Args:
+            value (float or array): Temperatures
+
+        Returns:
+            np.ndarray: int16 stored values
+        """
+        value = np.asarray(value, dtype=np.float64)
+        scaled = np.clip(np.round(value * self.SCALE), -self.LIMIT, self.LIMIT)
+
+        return np.where(np.isnan(value), self.MISSING, scaled).astype(np.int16)
+
+    def decode(self, raw) -> np.ndarray:
+        """Convert stored values back to temperatures
+
+        Args:
+            raw (np.ndarray): int16 stored values
+
+        Returns:
+            np.ndarray: float64 temperatures, NaN where missing
+        """
+        return np.where(raw == self.MISSING, np.nan, raw / self.SCALE)
+
+    def __getitem__(self, key):
+        value = self.decode(self.raw[key])
+
+        return float(value) if value.ndim == 0 else value
+
+    def __setitem__(self, key, value) -> None:
+        self.raw[key] = self.encode(value)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        values = self.decode(self.raw)
+
+        return values if dtype is None else values.astype(dtype, copy=False)
@@ -1,3 +1,8 @@
-sudo systemctl restart watches-controller
-sudo systemctl restart watches-sensor
-sudo systemctl restart watches-server
+# Restart every installed WATCHES service, the broker first and the plant manager last
+for service in watches-broker watches-controller watches-sensor watches-server watches-server-headless
+do
+    if [ -f /etc/systemd/system/$service.service ]
+    then
+        sudo systemctl restart $service
+    fi
+done
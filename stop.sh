@@ -1,3 +1,8 @@
-sudo systemctl stop watches-server
-sudo systemctl stop watches-sensor
-sudo systemctl stop watches-controller
\ No newline at end of file
+# Stop every installed WATCHES service, the broker last
+for service in watches-server watches-server-headless watches-sensor watches-controller watches-broker
+do
+    if [ -f /etc/systemd/system/$service.service ]
+    then
+        sudo systemctl stop $service
+    fi
+done
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The WATCHES modules live flat in python/ and are run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python"))
@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+
+import zmq
+
+from watches_broker import watches_broker
+from watches_sockets import apply_socket_policy, message_drain, sequenced_socket
+
+
+def start_broker(tmp_path, **overrides):
+    config = dict(broker_frontend=f"ipc://{tmp_path}/front", broker_backend=f"ipc://{tmp_path}/back",
+                  broker_zones={}, broker_lvc=True, broker_stats_interval=60,
+                  socket_policies={"temp": {"conflate": True}, "fanstate": {"conflate": True}})
+    config.update(overrides)
+    cfg = tmp_path / "watches_cfg.json"
+    cfg.write_text(json.dumps(dict(config=config)))
+
+    broker = watches_broker(str(cfg))
+    threading.Thread(target=broker.run, daemon=True).start()
+    return broker, config
+
+
+def drain_for(drain, seconds):
+    received = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        received += drain.poll()
+        time.sleep(0.02)
+    return received
+
+
+def test_publisher_keeps_sending_after_a_second_subscription(tmp_path):
+    broker, config = start_broker(tmp_path, broker_lvc=False)
+    ctx = zmq.Context()
+
+    # Set up the sensor's publisher the way the daemon does
+    publisher = sequenced_socket(ctx.socket(zmq.PUB), "temp_sensor")
+    apply_socket_policy(publisher, config)
+    publisher.connect(config["broker_frontend"])
+
+    # A plant manager subscribes to temp, then fanstate, the order that used to silence the sensor
+    subscriber = ctx.socket(zmq.SUB)
+    apply_socket_policy(subscriber, config)
+    subscriber.connect(config["broker_backend"])
+    subscriber.subscribe("temp")
+    time.sleep(0.2)
+    subscriber.subscribe("fanstate")
+    time.sleep(0.3)
+
+    drain = message_drain(subscriber, config, "test")
+    for i in range(10):
+        publisher.send_string(f"temp::{70 + i}::12:00:00")
+        time.sleep(0.02)
+
+    received = drain_for(drain, 0.5)
+
+    assert received and all(msg.startswith("temp::") for msg in received)
+    assert received[-1] == "temp::79::12:00:00"
+
+    publisher.close(linger=0)
+    subscriber.close(linger=0)
+    ctx.term()
+
+
+def subscriber_replay(ctx, config, topic):
+    subscriber = ctx.socket(zmq.SUB)
+    subscriber.connect(config["broker_backend"])
+    subscriber.subscribe(topic)
+    replayed = subscriber.recv_string() if subscriber.poll(500) else None
+    subscriber.close(linger=0)
+    return replayed
+
+
+def test_last_value_cache_skips_stale_values(tmp_path):
+    broker, config = start_broker(tmp_path, broker_lvc_max_age=0.5)
+    ctx = zmq.Context()
+
+    # A running plant manager keeps the subscriptions open, so the publisher sends to the broker
+    listener = ctx.socket(zmq.SUB)
+    listener.connect(config["broker_backend"])
+    listener.subscribe("temp")
+    listener.subscribe("fancontrol")
+
+    publisher = ctx.socket(zmq.PUB)
+    publisher.connect(config["broker_frontend"])
+    time.sleep(0.3)
+    publisher.send_string("temp::71::12:00:00")
+    publisher.send_string("fancontrol::turnon")
+    time.sleep(0.1)
+
+    # A fresh value is replayed to a new subscriber, a command never is
+    assert subscriber_replay(ctx, config, "temp") == "temp::71::12:00:00"
+    assert subscriber_replay(ctx, config, "fancontrol") is None
+
+    # Once the publisher has gone quiet for longer than the maximum age, nothing is replayed
+    time.sleep(0.5)
+    assert subscriber_replay(ctx, config, "temp") is None
+
+    listener.close(linger=0)
+    publisher.close(linger=0)
+    ctx.term()
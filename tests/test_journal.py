@@ -0,0 +1,37 @@
+import os
+import time
+from datetime import datetime as dt
+
+import pytest
+
+from watches_journal import journal_files, journal_writer
+
+
+@pytest.fixture
+def new_york_time():
+    old_tz = os.environ.get("TZ")
+    os.environ["TZ"] = "America/New_York"
+    time.tzset()
+    yield
+    if old_tz is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = old_tz
+    time.tzset()
+
+
+@pytest.mark.parametrize("day, hours", [("2024-03-10", 23), ("2024-11-03", 25)])
+def test_day_file_ends_at_local_midnight_on_dst_days(tmp_path, new_york_time, day, hours):
+    start = dt.fromisoformat(day).timestamp()
+    journal = journal_writer({}, "PLANTMANAGER", str(tmp_path))
+
+    journal.open_day(start + 60)
+    assert journal._day_end - start == hours * 60 * 60
+
+    # The first event after local midnight goes in the next day's file, not before or after it
+    journal.record_state("fan_command", "on", start + hours * 60 * 60 - 1)
+    journal.record_state("fan_command", "off", start + hours * 60 * 60)
+    journal.close()
+
+    names = [os.path.basename(p) for p in journal_files(str(tmp_path))]
+    assert names == [f"PLANTMANAGER-{day}.jnl", f"PLANTMANAGER-{day[:-2]}{int(day[-2:]) + 1:02d}.jnl"]
@@ -1,14 +1,13 @@
-sudo systemctl stop watches-server
-sudo systemctl stop watches-sensor
-sudo systemctl stop watches-controller
-
-sudo systemctl disable watches-server
-sudo systemctl disable watches-sensor
-sudo systemctl disable watches-controller
-
-sudo rm /etc/systemd/system/watches-server.service
-sudo rm /etc/systemd/system/watches-sensor.service
-sudo rm /etc/systemd/system/watches-controller.service
+# Remove every installed WATCHES service
+for service in watches-server watches-server-headless watches-sensor watches-controller watches-broker
+do
+    if [ -f /etc/systemd/system/$service.service ]
+    then
+        sudo systemctl stop $service
+        sudo systemctl disable $service
+        sudo rm /etc/systemd/system/$service.service
+    fi
+done
 
 sudo systemctl daemon-reload
 sudo systemctl reset-failed